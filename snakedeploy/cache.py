@@ -0,0 +1,274 @@
+from contextlib import contextmanager
+import hashlib
+import json
+import os
+from pathlib import Path
+import shutil
+import subprocess as sp
+import tarfile
+import time
+from typing import Dict, List, Optional
+
+from snakedeploy.exceptions import UserError
+from snakedeploy.logger import logger
+from snakedeploy.utils import get_cache_dir
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # no advisory locking available (e.g. on Windows)
+    fcntl = None
+
+
+DEFAULT_MAX_SIZE = 5 * 1024**3
+
+DEFAULT_SOLVE_TTL = 24 * 3600
+DEFAULT_SOLVE_MAX_SIZE = 100 * 1024**2
+
+
+@contextmanager
+def file_lock(path: Path, exclusive: bool = True, blocking: bool = True):
+    """
+    Hold an advisory lock on the given file. Yields False if the lock is
+    not available and blocking is False.
+    """
+    with open(path, "a") as lockfile:
+        if fcntl is None:
+            yield True
+            return
+        flags = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(lockfile, flags)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+
+def get_dir_size(path: Path) -> int:
+    size = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            try:
+                size += os.lstat(os.path.join(root, f)).st_size
+            except FileNotFoundError:
+                pass
+    return size
+
+
+class CloneCache:
+    """
+    A persistent cache of bare git mirrors, keyed by source URL.
+
+    Mirrors are updated with an incremental fetch and a requested ref is
+    materialized by exporting it via git archive, extracting only the paths
+    needed for deployment. Concurrent users of the same cache directory are
+    serialized by a lock per mirror. Least recently used mirrors are evicted
+    once the cache exceeds max_size bytes.
+    """
+
+    def __init__(
+        self, cache_dir: Optional[Path] = None, max_size: int = DEFAULT_MAX_SIZE
+    ):
+        self.path = Path(cache_dir or get_cache_dir()) / "mirrors"
+        self.max_size = max_size
+        os.makedirs(self.path, exist_ok=True)
+
+    def mirror_path(self, source_url: str) -> Path:
+        digest = hashlib.sha256(source_url.encode()).hexdigest()[:16]
+        name = source_url.rstrip("/").split("/")[-1]
+        return self.path / f"{name}-{digest}.git"
+
+    def lock_path(self, mirror: Path) -> Path:
+        return mirror.with_suffix(".lock")
+
+    def has_commit(self, mirror: Path, ref: str) -> bool:
+        """Return True if ref is a commit hash that is already in the mirror."""
+        # imported here, since the SolveCache (used by the conda subcommands)
+        # does not need providers and thereby requests
+        from snakedeploy.providers import COMMIT_RE
+
+        if not (COMMIT_RE.match(ref) and (mirror / "HEAD").exists()):
+            return False
+        return (
+            sp.run(
+                ["git", "cat-file", "-e", f"{ref}^{{commit}}"],
+                cwd=mirror,
+                stderr=sp.DEVNULL,
+            ).returncode
+            == 0
+        )
+
+    @logger.timed()
+    def update(self, source_url: str) -> Path:
+        """
+        Create or incrementally update the mirror of the given source URL.
+        Has to be called while holding the lock of the mirror.
+        """
+        mirror = self.mirror_path(source_url)
+        try:
+            if (mirror / "HEAD").exists():
+                logger.info(f"Updating cached mirror of {source_url}...")
+                sp.run(
+                    ["git", "fetch", "--quiet", "--prune", "--tags", "origin"],
+                    cwd=mirror,
+                    check=True,
+                )
+            else:
+                logger.info(f"Creating cached mirror of {source_url}...")
+                shutil.rmtree(mirror, ignore_errors=True)
+                sp.run(
+                    ["git", "clone", "--quiet", "--mirror", source_url, str(mirror)],
+                    check=True,
+                )
+        except sp.CalledProcessError as e:
+            raise UserError(f"Failed to mirror repository {source_url}:\n{e}")
+        return mirror
+
+    @logger.timed()
+    def materialize(self, source_url: str, ref: Optional[str], dest: str) -> str:
+        """
+        Export the files needed for deployment at the given ref (default: HEAD)
+        of the given source URL into dest. Returns the corresponding commit.
+        """
+        from snakedeploy.providers import extract_deploy_members
+
+        ref = ref or "HEAD"
+        mirror = self.mirror_path(source_url)
+        lock = self.lock_path(mirror)
+        with file_lock(lock):
+            if not self.has_commit(mirror, ref):
+                self.update(source_url)
+            lock.touch()
+            try:
+                commit = sp.run(
+                    ["git", "rev-parse", "--verify", "--quiet", f"{ref}^{{commit}}"],
+                    cwd=mirror,
+                    check=True,
+                    stdout=sp.PIPE,
+                    text=True,
+                ).stdout.strip()
+            except sp.CalledProcessError:
+                raise UserError(f"Failed to checkout ref {ref} of {source_url}.")
+            archive = sp.Popen(
+                ["git", "archive", "--format=tar", commit],
+                cwd=mirror,
+                stdout=sp.PIPE,
+                stderr=sp.PIPE,
+            )
+            try:
+                extract_deploy_members(archive.stdout, dest)
+            except tarfile.TarError:
+                # an unknown ref yields an empty stream, reported below
+                if archive.wait() == 0:
+                    raise
+            _, stderr = archive.communicate()
+            if archive.returncode != 0:
+                raise UserError(
+                    f"Failed to checkout ref {ref} of {source_url}:\n"
+                    + stderr.decode(errors="replace")
+                )
+        self.evict()
+        return commit
+
+    @logger.timed()
+    def evict(self):
+        """
+        Remove least recently used mirrors until the cache fits into max_size.
+        Mirrors that are currently in use are skipped.
+        """
+        with file_lock(self.path / "evict.lock", blocking=False) as acquired:
+            if not acquired:
+                return
+            mirrors = []
+            for mirror in self.path.glob("*.git"):
+                lock = self.lock_path(mirror)
+                last_used = lock.stat().st_mtime if lock.exists() else 0
+                mirrors.append((last_used, mirror, get_dir_size(mirror)))
+            total = sum(size for _, _, size in mirrors)
+            for _, mirror, size in sorted(mirrors):
+                if total <= self.max_size:
+                    break
+                with file_lock(self.lock_path(mirror), blocking=False) as acquired:
+                    if not acquired:
+                        continue
+                    logger.info(f"Evicting {mirror.name} from clone cache...")
+                    shutil.rmtree(mirror, ignore_errors=True)
+                    total -= size
+
+
+class SolveCache:
+    """
+    A persistent cache of conda solver results (lists of package records),
+    keyed by a hash of everything a solution depends on (see
+    CondaEnvProcessor.get_solve_key). Entries expire ttl seconds after they
+    have been stored, and the oldest ones are evicted once the cache exceeds
+    max_size bytes.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[Path] = None,
+        ttl: float = DEFAULT_SOLVE_TTL,
+        max_size: int = DEFAULT_SOLVE_MAX_SIZE,
+    ):
+        self.path = Path(cache_dir or get_cache_dir()) / "solves"
+        self.ttl = ttl
+        self.max_size = max_size
+
+    def entry_path(self, key: str) -> Path:
+        return self.path / f"{key}.json"
+
+    def is_expired(self, stat: os.stat_result) -> bool:
+        return time.time() - stat.st_mtime > self.ttl
+
+    def get(self, key: str) -> Optional[List[Dict]]:
+        """Return the cached records for the given key, or None if there are none."""
+        path = self.entry_path(key)
+        try:
+            if self.is_expired(path.stat()):
+                return None
+            with open(path) as f:
+                return json.load(f)["records"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, key: str, records: List[Dict]):
+        path = self.entry_path(key)
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+            with open(tmp_path, "w") as f:
+                json.dump({"records": records}, f)
+            os.replace(tmp_path, path)
+        except OSError:
+            # the cache is an optimization only
+            pass
+
+    @logger.timed()
+    def evict(self):
+        """
+        Remove expired entries, and the oldest further ones until the cache
+        fits into max_size.
+        """
+        entries = []
+        for path in self.path.glob("*.json"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if self.is_expired(stat):
+                path.unlink(missing_ok=True)
+            else:
+                entries.append((stat.st_mtime, path, stat.st_size))
+        total = sum(size for _, _, size in entries)
+        for _, path, size in sorted(entries):
+            if total <= self.max_size:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
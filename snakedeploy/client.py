@@ -7,15 +7,25 @@ __license__ = "MPL 2.0"
 import argparse
 import sys
 from pathlib import Path
-from snakedeploy.conda import pin_conda_envs, update_conda_envs
 
 from snakedeploy.logger import setup_logger
-from snakedeploy.deploy import deploy
-from snakedeploy.collect_files import collect_files
 import snakedeploy
 from snakedeploy.exceptions import UserError
-from snakedeploy.scaffold_plugins import scaffold_plugin
-from .snakemake_wrappers import update_snakemake_wrappers
+from snakedeploy.utils import LINK_MODES, parse_size
+
+# Subcommand modules (and their heavy dependencies like pandas, PyGithub or
+# requests) are imported on dispatch only, in order to keep startup fast.
+
+
+def positive_int(value: str) -> int:
+    """Parse a positive number of e.g. jobs (argparse type)."""
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, got {value}")
+    return number
 
 
 def get_parser():
@@ -59,10 +69,29 @@ def get_parser():
         action="store_true",
     )
 
+    profile_help = (
+        "Record the duration of the individual phases (e.g. cloning, copying, "
+        "conda calls, GitHub API calls) and write them to the given file as trace "
+        "in the Chrome trace event format (viewable with chrome://tracing or "
+        "https://ui.perfetto.dev)."
+    )
+    logging_group.add_argument("--profile-json", metavar="FILE", help=profile_help)
+
+    # --profile-json is accepted after the subcommand as well, without
+    # overriding a value given before it
+    profile_parser = argparse.ArgumentParser(add_help=False)
+    profile_parser.add_argument(
+        "--profile-json",
+        metavar="FILE",
+        default=argparse.SUPPRESS,
+        help=profile_help,
+    )
+
     subparsers = parser.add_subparsers(title="Subcommands", dest="subcommand")
 
     deploy_workflow_parser = subparsers.add_parser(
         "deploy-workflow",
+        parents=[profile_parser],
         description="Deploy a workflow from a git repository.",
         help="Deploy a workflow from a git repository.",
     )
@@ -71,17 +100,20 @@ def get_parser():
 
     deploy_workflow_parser.add_argument(
         "repo",
+        nargs="?",
         help="Workflow repository to use.",
     )
 
     deploy_workflow_parser.add_argument(
         "dest",
+        nargs="?",
         help="Path to create the deploying workflow in.",
     )
 
     deploy_workflow_parser.add_argument(
         "--tag",
-        help="Git tag to deploy from (e.g. a certain release).",
+        help="Git tag to deploy from (e.g. a certain release). A commit hash "
+        "(full or abbreviated to at least 7 characters) is accepted as well.",
     )
 
     deploy_workflow_parser.add_argument(
@@ -100,8 +132,117 @@ def get_parser():
         help="Enforce overwriting of already present files.",
     )
 
+    deploy_workflow_parser.add_argument(
+        "--update",
+        action="store_true",
+        help="Update an existing deployment, only writing files whose content "
+        "differs (compared via size and modification time, or content). Unchanged "
+        "files are not touched, so that their modification times are retained. "
+        "Deployments that are up to date with the given ref are skipped, unless "
+        "--force is given as well.",
+    )
+
+    deploy_workflow_parser.add_argument(
+        "--validate",
+        action="append",
+        default=[],
+        metavar="FILE",
+        help="After deployment, validate the given file (relative to dest, e.g. "
+        "config/samples.tsv) against the workflow schema named after the file "
+        "(e.g. workflow/schemas/samples.schema.yaml). Sample sheets (.tsv, .csv) "
+        "are validated row by row, in chunks. Can be given multiple times.",
+    )
+
+    deploy_workflow_parser.add_argument(
+        "--link-mode",
+        choices=LINK_MODES,
+        default="copy",
+        help="How to put config and profile files into place: copy them, hardlink "
+        "them from the (temporary) clone, use copy-on-write reflinks (if supported by "
+        "the filesystem), or auto (reflink, then hardlink, then copy). Unsupported "
+        "modes fall back to copying. Files are never hardlinked from local "
+        "repositories or from clones shared by several destinations of a manifest.",
+    )
+
+    deploy_workflow_parser.add_argument(
+        "--manifest",
+        help="Deploy many workflows at once, as given by a TSV file with the columns "
+        "repo, dest, tag, branch and name (optional) instead of the repo and dest "
+        "arguments. Each combination of repository and tag/branch is cloned only once.",
+    )
+
+    deploy_workflow_parser.add_argument(
+        "--jobs",
+        type=positive_int,
+        default=8,
+        help="Number of destinations to deploy into in parallel when using --manifest.",
+    )
+
+    source_group = deploy_workflow_parser.add_mutually_exclusive_group()
+
+    source_group.add_argument(
+        "--archive",
+        action="store_true",
+        help="Obtain the workflow via an archive download over HTTPS instead of "
+        "a git clone (GitHub and GitLab only). Does not require git.",
+    )
+
+    source_group.add_argument(
+        "--cache",
+        action="store_true",
+        help="Keep a persistent mirror of the workflow repository and obtain "
+        "the requested ref from it, only fetching new commits on subsequent deployments.",
+    )
+
+    deploy_workflow_parser.add_argument(
+        "--cache-dir",
+        help="Directory for the persistent repository cache "
+        "(default: $XDG_CACHE_HOME/snakedeploy or ~/.cache/snakedeploy).",
+    )
+
+    deploy_workflow_parser.add_argument(
+        "--cache-max-size",
+        default="5G",
+        help="Maximum size of the persistent repository cache. Least recently "
+        "used mirrors are evicted once it is exceeded.",
+    )
+
+    bundle_workflow_parser = subparsers.add_parser(
+        "bundle-workflow",
+        parents=[profile_parser],
+        description="Write an offline bundle of a workflow, containing everything "
+        "needed for deploying it (config, profiles, license, Snakefile, schemas and "
+        "the resolved commit). Deploy it without network access via "
+        "'snakedeploy deploy-workflow <path>.sdbundle <dest>'.",
+        help="Write an offline bundle of a workflow for deployment without network access.",
+    )
+    bundle_workflow_parser.add_argument(
+        "repo",
+        help="Workflow repository to use.",
+    )
+    bundle_workflow_parser.add_argument(
+        "output",
+        help="Path of the bundle to write (should end with .sdbundle). If this is a "
+        "directory, the bundle is named after repository, ref and content hash.",
+    )
+    bundle_workflow_parser.add_argument(
+        "--tag",
+        help="Git tag to bundle (e.g. a certain release).",
+    )
+    bundle_workflow_parser.add_argument(
+        "--branch",
+        help="Git branch to bundle.",
+    )
+    bundle_workflow_parser.add_argument(
+        "--archive",
+        action="store_true",
+        help="Obtain the workflow via an archive download over HTTPS instead of "
+        "a git clone (GitHub and GitLab only).",
+    )
+
     collect_files = subparsers.add_parser(
         "collect-files",
+        parents=[profile_parser],
         description="Collect files into a tabular structure, given input from "
         "STDIN formats glob patterns defined in a config sheet.",
     )
@@ -119,8 +260,41 @@ def get_parser():
         "If one STDIN input is matched by multiple of the provided stdin patterns, an error is thrown.",
     )
 
+    def add_conda_resolution_args(subparser):
+        subparser.add_argument(
+            "--create-envs",
+            action="store_true",
+            help="Resolve envs by creating them in temporary prefixes instead of "
+            "only asking the solver for the packages they would consist of "
+            "(dry-run). This is much slower, but may help if the solver output "
+            "of the used conda frontend lacks package URLs or checksums.",
+        )
+        subparser.add_argument(
+            "--no-solve-cache",
+            action="store_true",
+            help="Do not use cached solutions of envs. By default, solutions are "
+            "cached under $XDG_CACHE_HOME/snakedeploy and reused for envs with "
+            "the same dependencies and channels as long as the repodata of the "
+            "channels is unchanged (for at most a day).",
+        )
+        subparser.add_argument(
+            "--batch-solve",
+            action="store_true",
+            help="Solve all envs in a single long-lived conda process (per job), "
+            "such that the metadata of each channel is loaded only once instead "
+            "of once per env. Requires the Python API of conda, i.e. is not "
+            "available with mamba >= 2.",
+        )
+        subparser.add_argument(
+            "--scratch-dir",
+            help="Directory for the temporary environments of --create-envs. "
+            "Defaults to a directory in the first writable package cache of "
+            "conda, such that packages are hardlinked instead of copied.",
+        )
+
     pin_conda_envs = subparsers.add_parser(
         "pin-conda-envs",
+        parents=[profile_parser],
         help="Pin/lock given conda envrionments to compatible package URLs at the time of invocation.",
         description="Pin/lock given conda environment definition files (in YAML format) "
         "into a list of explicit package URLs including checksums, stored in a file "
@@ -165,6 +339,15 @@ def get_parser():
         action="store_true",
         help="Only warn if conda env evaluation fails and go on with the other envs.",
     )
+    pin_conda_envs.add_argument(
+        "--jobs",
+        type=positive_int,
+        default=1,
+        help="Number of envs to process in parallel (in separate processes, "
+        "sharing the package cache). The output of each env is shown once it "
+        "has been processed.",
+    )
+    add_conda_resolution_args(pin_conda_envs)
 
     def add_create_pr_args(subparser, entity: str):
         subparser.add_argument(
@@ -192,6 +375,7 @@ def get_parser():
 
     update_conda_envs = subparsers.add_parser(
         "update-conda-envs",
+        parents=[profile_parser],
         help="Update given conda environment definition files (in YAML format) "
         "so that all contained packages are set to the latest feasible versions.",
         description="Update given conda environment definition files (in YAML format) "
@@ -217,9 +401,26 @@ def get_parser():
         action="store_true",
         help="Only warn if conda env evaluation fails and go on with the other envs.",
     )
+    update_conda_envs.add_argument(
+        "--jobs",
+        type=positive_int,
+        default=1,
+        help="Number of envs to process in parallel (in separate processes, "
+        "sharing the package cache). The output of each env is shown once it "
+        "has been processed.",
+    )
+    add_conda_resolution_args(update_conda_envs)
+    update_conda_envs.add_argument(
+        "--precheck",
+        action="store_true",
+        help="Before solving an env, check the repodata of its channels for "
+        "newer versions of its dependencies, and skip the env if all of them "
+        "are already set to the latest version.",
+    )
 
     update_snakemake_wrappers = subparsers.add_parser(
         "update-snakemake-wrappers",
+        parents=[profile_parser],
         help="Update all snakemake wrappers in given Snakefiles to their latest versions.",
         description="Update all snakemake wrappers in given Snakefiles to their latest versions.",
     )
@@ -235,6 +436,7 @@ def get_parser():
 
     scaffold_snakemake_plugin = subparsers.add_parser(
         "scaffold-snakemake-plugin",
+        parents=[profile_parser],
         help="Scaffold a snakemake plugin by adding recommended dependencies and code snippets.",
         description="Scaffold a snakemake plugin by adding recommended dependencies and code snippets.",
     )
@@ -287,9 +489,50 @@ def main():
     )
     from snakedeploy.logger import logger
 
+    if args.profile_json:
+        logger.enable_profiling()
     try:
-        if args.subcommand == "deploy-workflow":
-            if not (args.tag or args.branch):
+        with logger.span(args.subcommand):
+            run(args)
+    except UserError as e:
+        logger.error(e)
+        sys.exit(1)
+    finally:
+        if args.profile_json:
+            logger.write_trace(args.profile_json)
+
+
+def run(args):
+    """Run the subcommand given by the parsed arguments."""
+    if args.subcommand == "deploy-workflow":
+        from snakedeploy.cache import CloneCache
+        from snakedeploy.deploy import deploy, deploy_many, read_manifest
+        from snakedeploy.providers import Bundle
+
+        cache = (
+            CloneCache(
+                cache_dir=args.cache_dir, max_size=parse_size(args.cache_max_size)
+            )
+            if args.cache
+            else None
+        )
+        if args.manifest:
+            if args.repo or args.dest:
+                raise UserError("Please specify either --manifest or repo and dest")
+            deploy_many(
+                read_manifest(args.manifest),
+                force=args.force,
+                cache=cache,
+                jobs=args.jobs,
+                link_mode=args.link_mode,
+                archive=args.archive,
+                update=args.update,
+                validate=args.validate,
+            )
+        else:
+            if not (args.repo and args.dest):
+                raise UserError("Please specify repo and dest (or --manifest)")
+            if not (args.tag or args.branch or Bundle.matches(args.repo)):
                 raise UserError("Please specify either --tag or --branch")
             deploy(
                 args.repo,
@@ -298,41 +541,76 @@ def main():
                 branch=args.branch,
                 dest_path=Path(args.dest),
                 force=args.force,
+                cache=cache,
+                link_mode=args.link_mode,
+                archive=args.archive,
+                update=args.update,
+                validate=args.validate,
             )
-        elif args.subcommand == "collect-files":
-            collect_files(config_sheet_path=args.config)
-        elif args.subcommand == "pin-conda-envs":
-            pin_conda_envs(
-                args.envfiles,
-                conda_frontend=args.conda_frontend,
-                create_prs=args.create_prs,
-                entity_regex=args.entity_regex,
-                pr_add_label=args.pr_add_label,
-                warn_on_error=args.warn_on_error,
-            )
-        elif args.subcommand == "update-conda-envs":
-            update_conda_envs(
-                args.envfiles,
-                conda_frontend=args.conda_frontend,
-                create_prs=args.create_prs,
-                pin_envs=args.pin_envs,
-                entity_regex=args.entity_regex,
-                pr_add_label=args.pr_add_label,
-                warn_on_error=args.warn_on_error,
-            )
-        elif args.subcommand == "update-snakemake-wrappers":
-            update_snakemake_wrappers(
-                args.snakefiles,
-                create_prs=args.create_prs,
-                per_snakefile_prs=args.per_snakefile_prs,
-                entity_regex=args.entity_regex,
-                pr_add_label=args.pr_add_label,
-            )
-        elif args.subcommand == "scaffold-snakemake-plugin":
-            scaffold_plugin(args.plugin_type)
-    except UserError as e:
-        logger.error(e)
-        sys.exit(1)
+    elif args.subcommand == "bundle-workflow":
+        from snakedeploy.deploy import bundle_workflow
+
+        if not (args.tag or args.branch):
+            raise UserError("Please specify either --tag or --branch")
+        bundle_workflow(
+            args.repo,
+            Path(args.output),
+            tag=args.tag,
+            branch=args.branch,
+            archive=args.archive,
+        )
+    elif args.subcommand == "collect-files":
+        from snakedeploy.collect_files import collect_files
+
+        collect_files(config_sheet_path=args.config)
+    elif args.subcommand == "pin-conda-envs":
+        from snakedeploy.conda import pin_conda_envs
+
+        pin_conda_envs(
+            args.envfiles,
+            conda_frontend=args.conda_frontend,
+            create_prs=args.create_prs,
+            entity_regex=args.entity_regex,
+            pr_add_label=args.pr_add_label,
+            warn_on_error=args.warn_on_error,
+            jobs=args.jobs,
+            create_envs=args.create_envs,
+            solve_cache=not args.no_solve_cache,
+            batch_solve=args.batch_solve,
+            scratch_dir=args.scratch_dir,
+        )
+    elif args.subcommand == "update-conda-envs":
+        from snakedeploy.conda import update_conda_envs
+
+        update_conda_envs(
+            args.envfiles,
+            conda_frontend=args.conda_frontend,
+            create_prs=args.create_prs,
+            pin_envs=args.pin_envs,
+            entity_regex=args.entity_regex,
+            pr_add_label=args.pr_add_label,
+            warn_on_error=args.warn_on_error,
+            jobs=args.jobs,
+            create_envs=args.create_envs,
+            solve_cache=not args.no_solve_cache,
+            batch_solve=args.batch_solve,
+            scratch_dir=args.scratch_dir,
+            precheck=args.precheck,
+        )
+    elif args.subcommand == "update-snakemake-wrappers":
+        from snakedeploy.snakemake_wrappers import update_snakemake_wrappers
+
+        update_snakemake_wrappers(
+            args.snakefiles,
+            create_prs=args.create_prs,
+            per_snakefile_prs=args.per_snakefile_prs,
+            entity_regex=args.entity_regex,
+            pr_add_label=args.pr_add_label,
+        )
+    elif args.subcommand == "scaffold-snakemake-plugin":
+        from snakedeploy.scaffold_plugins import scaffold_plugin
+
+        scaffold_plugin(args.plugin_type)
 
 
 if __name__ == "__main__":
@@ -1,22 +1,45 @@
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import copy
+import hashlib
 import json
+import multiprocessing.util
+import os
 from pathlib import Path
+import pickle
+import shlex
 import subprocess as sp
 import tempfile
 import re
 from glob import glob
 from itertools import chain
 import random
-from typing import Optional
+from typing import Dict, List, Optional
+from urllib.parse import unquote, urlparse
 
 from packaging import version as packaging_version
 import yaml
 
+from snakedeploy.cache import SolveCache
 from snakedeploy.exceptions import UserError
 from snakedeploy.logger import logger
-from snakedeploy.prs import PR, get_repo
 from snakedeploy.utils import YamlDumper
 from snakedeploy.conda_version import VersionOrder
+from snakedeploy.repodata import RepodataStore
+
+PACKAGE_EXTENSIONS = [".tar.bz2", ".conda"]
+
+DEFAULT_CHANNEL_ALIAS = "https://conda.anaconda.org"
+
+# timeout in seconds for determining the state of remote repodata
+REPODATA_TIMEOUT = 10
+
+SOLVER_SCRIPT = Path(__file__).with_name("conda_solver.py")
+
+# the name of the package in a dependency that update_env sets to a version
+SPEC_RE = re.compile("(?P<name>[^=>< ]+)[ =><]+")
+# a spec pinning a single version, e.g. "name =1.2", "name=1.2" or "name ==1.2"
+PIN_RE = re.compile(r"(?P<name>[^=>< ]+)\s*==?\s*(?P<version>[^=><!,|*\s]+)$")
 
 
 def pin_conda_envs(
@@ -26,18 +49,33 @@ def pin_conda_envs(
     pr_add_label=False,
     entity_regex=None,
     warn_on_error=False,
+    jobs=1,
+    create_envs=False,
+    solve_cache=True,
+    batch_solve=False,
+    scratch_dir=None,
 ):
     """Pin given conda envs by creating <conda-env>.<platform>.pin.txt
-    files with explicit URLs for all packages in each env."""
-    return CondaEnvProcessor(conda_frontend=conda_frontend).process(
-        conda_env_paths,
-        update_envs=False,
-        pin_envs=True,
-        create_prs=create_prs,
-        pr_add_label=pr_add_label,
-        entity_regex=entity_regex,
-        warn_on_error=warn_on_error,
-    )
+    files with explicit URLs for all packages in each env. Up to jobs envs
+    are processed in parallel. Envs are only solved, unless create_envs is
+    set (see CondaEnvProcessor)."""
+    with CondaEnvProcessor(
+        conda_frontend=conda_frontend,
+        create_envs=create_envs,
+        solve_cache=solve_cache,
+        batch_solve=batch_solve,
+        scratch_dir=scratch_dir,
+    ) as processor:
+        return processor.process(
+            conda_env_paths,
+            update_envs=False,
+            pin_envs=True,
+            create_prs=create_prs,
+            pr_add_label=pr_add_label,
+            entity_regex=entity_regex,
+            warn_on_error=warn_on_error,
+            jobs=jobs,
+        )
 
 
 def update_conda_envs(
@@ -48,23 +86,207 @@ def update_conda_envs(
     pr_add_label=False,
     entity_regex=None,
     warn_on_error=False,
+    jobs=1,
+    create_envs=False,
+    solve_cache=True,
+    batch_solve=False,
+    scratch_dir=None,
+    precheck=False,
 ):
     """Update the given conda env definitions such that all dependencies
-    in them are set to the latest feasible versions."""
-    return CondaEnvProcessor(conda_frontend=conda_frontend).process(
-        conda_env_paths,
-        create_prs=create_prs,
-        update_envs=True,
-        pin_envs=pin_envs,
-        pr_add_label=pr_add_label,
-        entity_regex=entity_regex,
-        warn_on_error=warn_on_error,
-    )
+    in them are set to the latest feasible versions. Up to jobs envs are
+    processed in parallel. Envs are only solved, unless create_envs is set
+    (see CondaEnvProcessor). With precheck, envs of which all dependencies
+    are already set to the latest versions in the channels are skipped
+    without solving them."""
+    with CondaEnvProcessor(
+        conda_frontend=conda_frontend,
+        create_envs=create_envs,
+        solve_cache=solve_cache,
+        batch_solve=batch_solve,
+        scratch_dir=scratch_dir,
+        precheck=precheck,
+    ) as processor:
+        return processor.process(
+            conda_env_paths,
+            create_prs=create_prs,
+            update_envs=True,
+            pin_envs=pin_envs,
+            pr_add_label=pr_add_label,
+            entity_regex=entity_regex,
+            warn_on_error=warn_on_error,
+            jobs=jobs,
+        )
+
+
+class EnvChanges:
+    """Collects changed files like a PR, to be passed between processes."""
+
+    def __init__(self):
+        self.files = []
+
+    def add_file(self, filepath, content, is_updated, msg):
+        self.files.append((str(filepath), content, is_updated, msg))
+
+
+EnvResult = namedtuple("EnvResult", "conda_env_path changes logs spans error")
+
+# the CondaEnvProcessor of a worker process (see _init_worker)
+_worker_processor = None
+
+
+def _init_worker(pickled_processor: bytes):
+    """
+    Set up the CondaEnvProcessor of a worker process, which is used (along
+    with its solver session) for all envs processed by the worker, and
+    closed when the worker exits. It is passed pickled, such that the worker
+    starts with a fresh state regardless of how the process is started.
+    """
+    global _worker_processor
+    _worker_processor = pickle.loads(pickled_processor)
+    # worker processes do not run atexit handlers, but these finalizers
+    multiprocessing.util.Finalize(None, _worker_processor.close, exitpriority=10)
+
+
+def _process_env_captured(
+    conda_env_path, update_envs, pin_envs, warn_on_error, profile
+) -> EnvResult:
+    """
+    Process the given env in a worker process, capturing log messages and
+    spans instead of emitting them. Errors are returned as messages.
+    """
+    processor = _worker_processor
+    logs = []
+    logger.log_handler = [logs.append]
+    logger.spans = [] if profile else None
+    changes, error = [], None
+    try:
+        changes = processor.process_env(
+            conda_env_path,
+            update_envs=update_envs,
+            pin_envs=pin_envs,
+            warn_on_error=warn_on_error,
+        )
+    except UserError as e:
+        error = str(e)
+    return EnvResult(conda_env_path, changes, logs, logger.spans or [], error)
+
+
+def _dist_name(record: Dict) -> str:
+    """Return the name of the package file of the given record, without extension."""
+    if "dist_name" in record:
+        return record["dist_name"]
+    fn = record.get("fn") or record["url"].rsplit("/", 1)[-1]
+    for ext in PACKAGE_EXTENSIONS:
+        if fn.endswith(ext):
+            return fn[: -len(ext)]
+    return fn
+
+
+class SolveError(Exception):
+    """Raised if an env cannot be solved in a SolverSession."""
+
+
+class SolverSession:
+    """
+    A long-lived process of conda (see conda_solver.py) that solves envs one
+    after another, loading the metadata of each channel only once.
+    """
+
+    def __init__(self, python: str):
+        # a file instead of a pipe, such that conda never blocks on its output
+        self.stderr = tempfile.TemporaryFile(mode="w+")
+        # isolated mode, such that the script directory (containing conda.py)
+        # does not shadow conda itself
+        self.process = sp.Popen(
+            [python, "-I", str(SOLVER_SCRIPT)],
+            stdin=sp.PIPE,
+            stdout=sp.PIPE,
+            stderr=self.stderr,
+            universal_newlines=True,
+        )
+        status = self.read_response()
+        if not status.get("memoized"):
+            logger.warning(
+                "The conda solver session reloads channel metadata for each env: "
+                f"{status.get('reason')}."
+            )
+
+    @logger.timed("SolverSession.solve")
+    def solve(
+        self, channels: List[str], override_channels: bool, specs: List[str]
+    ) -> List[Dict]:
+        request = dict(
+            channels=channels, override_channels=override_channels, specs=specs
+        )
+        try:
+            self.process.stdin.write(json.dumps(request) + "\n")
+            self.process.stdin.flush()
+        except BrokenPipeError:
+            pass
+        response = self.read_response()
+        if "error" in response:
+            raise SolveError(response["error"])
+        return response["records"]
+
+    def read_response(self) -> Dict:
+        response = self.process.stdout.readline()
+        if not response:
+            self.stderr.seek(0)
+            raise UserError(
+                f"The conda solver session terminated unexpectedly:\n{self.stderr.read()}"
+            )
+        return json.loads(response)
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+        self.stderr.close()
+
+
+def get_pinned_version(spec: str) -> Optional[str]:
+    """
+    Return the version a dependency spec is pinned to (e.g. 1.2 for
+    "name =1.2", "name=1.2" or "name ==1.2"), or None if the spec allows
+    other versions.
+    """
+    m = PIN_RE.match(spec.strip())
+    return m.group("version") if m is not None else None
 
 
 class CondaEnvProcessor:
-    def __init__(self, conda_frontend="mamba"):
+    """
+    Updates and pins conda envs. Envs are resolved by asking the solver for
+    the packages they would consist of (see solve), without downloading or
+    linking anything. With create_envs, they are instead created in
+    temporary prefixes, as done by earlier versions of snakedeploy.
+    Unless solve_cache is False, solutions are cached persistently (see
+    get_solve_key). With batch_solve, all envs are solved in a single
+    SolverSession per process instead of a conda process per env.
+    Temporary prefixes are created in scratch_dir (see get_scratch_dir).
+    With precheck, updates are skipped if the repodata of the channels
+    shows that they cannot change anything (see may_update).
+    """
+
+    def __init__(
+        self,
+        conda_frontend="mamba",
+        create_envs=False,
+        solve_cache=True,
+        batch_solve=False,
+        scratch_dir=None,
+        precheck=False,
+    ):
         self.conda_frontend = conda_frontend
+        self.scratch_dir = scratch_dir
+        self.precheck = precheck
+        self.repodata = RepodataStore()
+        self.create_envs = create_envs
+        self.solve_cache = SolveCache() if solve_cache else None
+        self.batch_solve = batch_solve
+        self._session = None
+        self._conda_config = None
+        self._repodata_states = {}
         self.info = json.loads(
             sp.check_output(
                 f"{conda_frontend} info --json",
@@ -74,6 +296,21 @@ class CondaEnvProcessor:
             )
         )
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __getstate__(self):
+        # each worker process starts its own solver session
+        return dict(self.__dict__, _session=None)
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
     def process(
         self,
         conda_env_paths,
@@ -83,9 +320,14 @@ class CondaEnvProcessor:
         pr_add_label: bool = False,
         entity_regex: Optional[str] = None,
         warn_on_error: bool = False,
+        jobs: int = 1,
     ):
+        if self.solve_cache is not None:
+            self.solve_cache.evict()
         repo = None
         if create_prs:
+            from snakedeploy.prs import PR, get_repo
+
             repo = get_repo()
         conda_envs = list(chain.from_iterable(map(glob, conda_env_paths)))
         random.shuffle(conda_envs)
@@ -94,6 +336,7 @@ class CondaEnvProcessor:
             logger.info(
                 f"No conda envs found at given paths: {', '.join(conda_env_paths)}"
             )
+        prs = {}
         for conda_env_path in conda_envs:
             if create_prs:
                 if pr_add_label and not entity_regex:
@@ -105,7 +348,7 @@ class CondaEnvProcessor:
                     "bug: either pin_envs or update_envs must be True"
                 )
                 mode = "bump" if update_envs else "pin"
-                pr = PR(
+                prs[conda_env_path] = PR(
                     f"perf: auto{mode} {conda_env_path}",
                     f"Automatic {mode} of {conda_env_path}.",
                     f"auto{mode}/{conda_env_path.replace('/', '-')}",
@@ -113,48 +356,136 @@ class CondaEnvProcessor:
                     entity=conda_env_path,
                     label_entity_regex=entity_regex if pr_add_label else None,
                 )
-            else:
-                pr = None
-            try:
-                updated = False
-                if update_envs:
-                    logger.info(f"Updating {conda_env_path}...")
-                    updated = self.update_env(
-                        conda_env_path, pr=pr, warn_on_error=warn_on_error
-                    )
-                if pin_envs and (
-                    not update_envs
-                    or updated
-                    or not self.get_pin_file_path(conda_env_path).exists()
-                ):
-                    logger.info(f"Pinning {conda_env_path}...")
-                    self.update_pinning(conda_env_path, pr)
-            except sp.CalledProcessError as e:
-                msg = f"Failed for conda env {conda_env_path}:\n{e.stderr}\n{e.stdout}"
-                if warn_on_error:
-                    logger.warning(msg)
-                else:
-                    raise UserError(msg)
+
+        def create_pr(conda_env_path, changes):
+            # PRs are always created from the main process
             if create_prs:
-                assert pr is not None
+                pr = prs[conda_env_path]
+                for change in changes:
+                    pr.add_file(*change)
                 pr.create()
 
+        if self.precheck and update_envs and jobs > 1:
+            # index the repodata once, instead of once per process
+            for conda_env_path in conda_envs:
+                with open(conda_env_path, "r") as infile:
+                    conda_env = yaml.load(infile, Loader=yaml.SafeLoader)
+                channels = [str(channel) for channel in conda_env.get("channels") or []]
+                for url in self.get_repodata_urls(channels):
+                    self.repodata.latest_versions(url)
+
+        if jobs <= 1:
+            for conda_env_path in conda_envs:
+                changes = self.process_env(
+                    conda_env_path,
+                    update_envs=update_envs,
+                    pin_envs=pin_envs,
+                    warn_on_error=warn_on_error,
+                )
+                create_pr(conda_env_path, changes)
+            return
+
+        errors = []
+        with ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=_init_worker,
+            initargs=(pickle.dumps(self),),
+        ) as executor:
+            futures = [
+                executor.submit(
+                    _process_env_captured,
+                    conda_env_path,
+                    update_envs=update_envs,
+                    pin_envs=pin_envs,
+                    warn_on_error=warn_on_error,
+                    profile=logger.spans is not None,
+                )
+                for conda_env_path in conda_envs
+            ]
+            for future in as_completed(futures):
+                if future.cancelled():
+                    continue
+                result = future.result()
+                # replay the output of the env at once, instead of interleaved
+                for msg in result.logs:
+                    logger.handler(msg)
+                if logger.spans is not None:
+                    logger.spans.extend(result.spans)
+                if result.error is not None:
+                    errors.append(result.error)
+                    # as in serial processing, do not start with further envs
+                    for pending in futures:
+                        pending.cancel()
+                    continue
+                create_pr(result.conda_env_path, result.changes)
+        if errors:
+            raise UserError("\n".join(errors))
+
+    def process_env(
+        self,
+        conda_env_path,
+        update_envs: bool = True,
+        pin_envs: bool = True,
+        warn_on_error: bool = False,
+    ) -> List[tuple]:
+        """
+        Update and/or pin the given env. Returns the changed files as
+        arguments for PR.add_file.
+        """
+        changes = EnvChanges()
+        try:
+            updated = False
+            records = None
+            if update_envs:
+                logger.info(f"Updating {conda_env_path}...")
+                updated, records = self.update_env(
+                    conda_env_path, pr=changes, warn_on_error=warn_on_error
+                )
+            if pin_envs and (
+                not update_envs
+                or updated
+                or not self.get_pin_file_path(conda_env_path).exists()
+            ):
+                logger.info(f"Pinning {conda_env_path}...")
+                # the updated env resolves to the packages of the posterior solve
+                self.update_pinning(conda_env_path, changes, records=records)
+        except (sp.CalledProcessError, SolveError) as e:
+            msg = f"Failed for conda env {conda_env_path}:\n"
+            if isinstance(e, SolveError):
+                msg += str(e)
+            else:
+                msg += f"{e.stderr}\n{e.stdout}"
+            if warn_on_error:
+                logger.warning(msg)
+            else:
+                raise UserError(msg)
+        return changes.files
+
+    @logger.timed()
     def update_env(
         self,
         conda_env_path,
         pr=None,
         warn_on_error=False,
     ):
-        spec_re = re.compile("(?P<name>[^=>< ]+)[ =><]+")
+        """
+        Set the dependencies of the given env to the latest feasible
+        versions. Returns whether the env file has been changed, along with
+        the package records the updated env resolves to (see resolve).
+        """
         with open(conda_env_path, "r") as infile:
             conda_env = yaml.load(infile, Loader=yaml.SafeLoader)
 
+        if self.precheck and not self.may_update(conda_env):
+            logger.info("All dependencies are at their latest versions, skipping.")
+            return False, None
+
         def process_dependencies(func):
             def process_dependency(dep):
                 if isinstance(dep, dict):
                     # leave e.g. pip subdicts unchanged
                     return dep
-                m = spec_re.match(dep)
+                m = SPEC_RE.match(dep)
                 if m is None:
                     # cannot parse the spec, leave unchanged
                     return dep
@@ -162,29 +493,17 @@ class CondaEnvProcessor:
 
             return [process_dependency(dep) for dep in conda_env["dependencies"]]
 
-        def get_pkg_versions(conda_env_path):
-            with tempfile.TemporaryDirectory(dir=".", prefix=".") as tmpdir:
-                self.exec_conda(f"env create --file {conda_env_path} --prefix {tmpdir}")
-                results = json.loads(
-                    self.exec_conda(f"list --json --prefix {tmpdir}").stdout
-                )
-                pkg_versions = {pkg["name"]: pkg["version"] for pkg in results}
-                self.exec_conda(f"env remove --prefix {tmpdir} -y")
-            return pkg_versions, results
-
         logger.info("Resolving prior versions...")
-        prior_pkg_versions, _ = get_pkg_versions(conda_env_path)
+        prior_pkg_versions, _ = self.get_pkg_versions(conda_env)
 
         unconstrained_deps = process_dependencies(lambda name: name)
         unconstrained_env = dict(conda_env)
         unconstrained_env["dependencies"] = unconstrained_deps
 
-        with tempfile.NamedTemporaryFile(
-            mode="w", suffix=".yaml", dir=".", prefix="."
-        ) as tmpenv:
-            yaml.dump(unconstrained_env, tmpenv, Dumper=YamlDumper)
-            logger.info("Resolving posterior versions...")
-            posterior_pkg_versions, posterior_pkg_json = get_pkg_versions(tmpenv.name)
+        logger.info("Resolving posterior versions...")
+        posterior_pkg_versions, posterior_pkg_json = self.get_pkg_versions(
+            unconstrained_env
+        )
 
         def downgraded():
             for pkg_name, version in posterior_pkg_versions.items():
@@ -229,15 +548,52 @@ class CondaEnvProcessor:
                     is_updated=True,
                     msg=f"perf: update {conda_env_path}.",
                 )
-            return True
+            return True, posterior_pkg_json
         else:
             logger.info("No updates in env.")
-            return False
+            return False, posterior_pkg_json
+
+    @logger.timed()
+    def may_update(self, conda_env: Dict) -> bool:
+        """
+        Check cheaply, without solving, whether update_env could change the
+        given env. This is not the case if each dependency that update_env
+        sets to a version is already pinned (e.g. as "name =version") to the
+        latest version of the package in the repodata of the env channels,
+        or a later one.
+        """
+        channels = [str(channel) for channel in conda_env.get("channels") or []]
+        urls = self.get_repodata_urls(channels)
+        for dep in conda_env.get("dependencies") or []:
+            if isinstance(dep, dict):
+                continue
+            m = SPEC_RE.match(dep)
+            if m is None:
+                # left unchanged by update_env
+                continue
+            name = m.group("name")
+            pinned = get_pinned_version(dep)
+            if pinned is None:
+                return True
+            latest = self.repodata.latest_version(name, urls)
+            if latest is None:
+                return True
+            try:
+                if VersionOrder(pinned) < VersionOrder(latest):
+                    return True
+            except ValueError:
+                return True
+        return False
 
     def get_pin_file_path(self, conda_env_path):
         return Path(conda_env_path).with_suffix(f".{self.info['platform']}.pin.txt")
 
-    def update_pinning(self, conda_env_path, pr=None):
+    @logger.timed()
+    def update_pinning(self, conda_env_path, pr=None, records=None):
+        """
+        Write the pin file of the given env. If given, records are taken as
+        the already resolved packages of the env instead of resolving it.
+        """
         pin_file = self.get_pin_file_path(conda_env_path)
         old_content = None
         updated = False
@@ -245,37 +601,320 @@ class CondaEnvProcessor:
             with open(pin_file, "r") as infile:
                 old_content = infile.read()
 
-        with tempfile.TemporaryDirectory(dir=".", prefix=".") as tmpdir:
-            self.exec_conda(f"env create --prefix {tmpdir} --file {conda_env_path}")
-            self.exec_conda(
-                f"list --explicit --md5 --prefix {tmpdir} > {tmpdir}/pin.txt"
-            )
-            with open(f"{tmpdir}/pin.txt", "r") as infile:
-                new_content = infile.read()
-            updated = old_content != new_content
-            if updated:
-                with open(pin_file, "w") as outfile:
-                    outfile.write(new_content)
-                if pr:
-                    msg = (
-                        "perf: update env pinning."
-                        if old_content is not None
-                        else f"feat: add pinning for {conda_env_path}."
+        if records is None:
+            with open(conda_env_path, "r") as infile:
+                conda_env = yaml.load(infile, Loader=yaml.SafeLoader)
+            records = self.resolve(conda_env)
+        new_content = self.format_explicit(records)
+        updated = old_content != new_content
+        if updated:
+            with open(pin_file, "w") as outfile:
+                outfile.write(new_content)
+            if pr:
+                msg = (
+                    "perf: update env pinning."
+                    if old_content is not None
+                    else f"feat: add pinning for {conda_env_path}."
+                )
+                pr.add_file(
+                    pin_file,
+                    new_content,
+                    is_updated=old_content is not None,
+                    msg=msg,
+                )
+
+    def get_pkg_versions(self, conda_env: Dict):
+        """
+        Resolve the given env definition and return a map of package names
+        to versions along with the package records (see resolve).
+        """
+        records = self.resolve(conda_env)
+        return {record["name"]: record["version"] for record in records}, records
+
+    def resolve(self, conda_env: Dict) -> List[Dict]:
+        """
+        Return the records (with at least name, version, url and md5) of
+        all packages the given env definition resolves to, in installation
+        order.
+        """
+        key = None
+        if self.solve_cache is not None:
+            key = self.get_solve_key(conda_env)
+            if key is not None:
+                records = self.solve_cache.get(key)
+                if records is not None:
+                    logger.info("Using cached solution.")
+                    return records
+        if self.create_envs:
+            records = self.resolve_by_creation(conda_env)
+        else:
+            records = self.solve(conda_env)
+        if key is not None:
+            self.solve_cache.put(key, records)
+        return records
+
+    @property
+    def conda_config(self) -> Dict:
+        """The conda configuration relevant for solving (empty if unavailable)."""
+        if self._conda_config is None:
+            try:
+                self._conda_config = json.loads(
+                    self.exec_conda(
+                        "config --show channel_priority channel_alias "
+                        "default_channels --json"
+                    ).stdout
+                )
+            except (sp.CalledProcessError, ValueError):
+                logger.debug("Failed to obtain conda configuration.")
+                self._conda_config = {}
+        return self._conda_config
+
+    def get_repodata_urls(self, channels: List[str]) -> List[str]:
+        """Return the URLs of all repodata files relevant for the given env channels."""
+
+        def channel_url(channel):
+            # as returned by conda config --show
+            return f"{channel['scheme']}://{channel['location']}/{channel['name']}"
+
+        alias = self.conda_config.get("channel_alias")
+        alias = channel_url(alias).rstrip("/") if alias else DEFAULT_CHANNEL_ALIAS
+        urls = []
+        for channel in channels:
+            if channel == "nodefaults":
+                continue
+            if channel == "defaults":
+                bases = map(channel_url, self.conda_config.get("default_channels", []))
+            elif "://" in channel:
+                bases = [channel]
+            else:
+                bases = [f"{alias}/{channel}"]
+            for base in bases:
+                for subdir in (self.info["platform"], "noarch"):
+                    urls.append(f"{base.rstrip('/')}/{subdir}/repodata.json")
+        if "nodefaults" not in channels:
+            # the configured channels, already including the subdirs
+            urls.extend(f"{url}/repodata.json" for url in self.info.get("channels", []))
+        return list(dict.fromkeys(urls))
+
+    def get_repodata_state(self, url: str) -> Optional[str]:
+        """
+        Return a token that changes whenever the given repodata changes, or
+        None if this cannot be determined.
+        """
+        if url in self._repodata_states:
+            return self._repodata_states[url]
+        state = None
+        if url.startswith("file://"):
+            try:
+                stat = os.stat(unquote(urlparse(url).path))
+                state = f"{stat.st_mtime_ns}-{stat.st_size}"
+            except FileNotFoundError:
+                state = "missing"
+        else:
+            import requests
+
+            from snakedeploy.providers import get_session
+
+            try:
+                response = get_session().head(
+                    url, allow_redirects=True, timeout=REPODATA_TIMEOUT
+                )
+                if response.status_code == 404:
+                    state = "missing"
+                elif response.ok:
+                    state = response.headers.get("ETag") or response.headers.get(
+                        "Last-Modified"
                     )
-                    pr.add_file(
-                        pin_file,
-                        new_content,
-                        is_updated=old_content is not None,
-                        msg=msg,
+            except requests.RequestException as e:
+                logger.debug(f"Failed to obtain state of {url}: {e}")
+        self._repodata_states[url] = state
+        return state
+
+    def get_solve_key(self, conda_env: Dict) -> Optional[str]:
+        """
+        Return a hash of everything the solution of the given env depends on:
+        its dependencies and channels, the channel priority, the platform and
+        virtual packages, and the state of the repodata of all channels.
+        Returns None if the latter cannot be determined.
+        """
+        channels = [str(channel) for channel in conda_env.get("channels") or []]
+        repodata = {}
+        for url in self.get_repodata_urls(channels):
+            state = self.get_repodata_state(url)
+            if state is None:
+                return None
+            repodata[url] = state
+        spec = dict(
+            conda_frontend=self.conda_frontend,
+            dependencies=sorted(
+                dep if isinstance(dep, str) else json.dumps(dep, sort_keys=True)
+                for dep in conda_env.get("dependencies") or []
+            ),
+            channels=channels,
+            channel_priority=self.conda_config.get("channel_priority"),
+            platform=self.info["platform"],
+            virtual_packages=self.info.get("virtual_pkgs"),
+            repodata=repodata,
+        )
+        return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()
+
+    @logger.timed()
+    def solve(self, conda_env: Dict) -> List[Dict]:
+        """
+        Resolve the given env definition with a dry-run of conda create (or
+        in the solver session, see batch_solve), i.e. without downloading or
+        linking any package. As with conda env create, pip is added if the
+        env contains pip dependencies, which are not resolved themselves.
+        """
+        channels = conda_env.get("channels") or []
+        specs = []
+        has_pip_deps = False
+        for dep in conda_env.get("dependencies") or []:
+            if isinstance(dep, dict):
+                has_pip_deps = has_pip_deps or "pip" in dep
+            else:
+                specs.append(str(dep))
+        if has_pip_deps and not any(
+            re.match(r"pip($|[ =><!~\[])", spec) for spec in specs
+        ):
+            specs.append("pip")
+
+        session = self.get_session()
+        if session is not None:
+            return session.solve(
+                [channel for channel in channels if channel != "nodefaults"],
+                "nodefaults" in channels,
+                specs,
+            )
+
+        args = ["create", "--dry-run", "--json", "--yes"]
+        for channel in channels:
+            if channel != "nodefaults":
+                args.extend(["--channel", channel])
+        if "nodefaults" in channels:
+            args.append("--override-channels")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # the prefix is never created
+            args.extend(["--prefix", os.path.join(tmpdir, "env")])
+            solution = json.loads(self.exec_conda(shlex.join(args + specs)).stdout)
+
+        actions = solution.get("actions") or {}
+        # only packages that are not in the package cache yet are fetched
+        fetched = {_dist_name(record): record for record in actions.get("FETCH", [])}
+        records = []
+        for record in actions.get("LINK", []):
+            if "url" not in record or "md5" not in record:
+                dist_name = _dist_name(record)
+                record = fetched.get(dist_name) or self.get_cached_record(dist_name)
+                if record is None:
+                    raise UserError(
+                        f"Cannot determine URL and checksum of package {dist_name} "
+                        "from the solver output. Consider using --create-envs."
                     )
+            records.append(record)
+        return records
+
+    def get_session(self) -> Optional[SolverSession]:
+        """Return the solver session of this process, if batch_solve is enabled."""
+        if self.batch_solve and self._session is None:
+            python = self.info.get("sys.executable")
+            if python is None:
+                logger.warning(
+                    f"Batch solving is not supported by {self.conda_frontend}, "
+                    "solving each env separately."
+                )
+                self.batch_solve = False
+            else:
+                self._session = SolverSession(python)
+        return self._session
+
+    def get_cached_record(self, dist_name: str) -> Optional[Dict]:
+        """Return the record of the given package from the package cache, if any."""
+        for pkgs_dir in self.info.get("pkgs_dirs", []):
+            path = Path(pkgs_dir) / dist_name / "info" / "repodata_record.json"
+            try:
+                with open(path) as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                continue
+        return None
+
+    @logger.timed()
+    def resolve_by_creation(self, conda_env: Dict) -> List[Dict]:
+        """Resolve the given env definition by creating it in a temporary prefix."""
+        with (
+            tempfile.NamedTemporaryFile(
+                mode="w", suffix=".yaml", dir=".", prefix="."
+            ) as tmpenv,
+            tempfile.TemporaryDirectory(
+                dir=self.get_scratch_dir(), prefix=".snakedeploy-"
+            ) as tmpdir,
+        ):
+            yaml.dump(conda_env, tmpenv, Dumper=YamlDumper)
+            tmpenv.flush()
+            self.exec_conda(f"env create --file {tmpenv.name} --prefix {tmpdir}")
+            explicit = self.exec_conda(f"list --explicit --md5 --prefix {tmpdir}")
+            records = []
+            for line in explicit.stdout.splitlines():
+                if not line or line.startswith(("#", "@")):
+                    continue
+                url, _, md5 = line.partition("#")
+                meta = Path(tmpdir) / "conda-meta" / f"{_dist_name(dict(url=url))}.json"
+                with open(meta) as f:
+                    record = json.load(f)
+                records.append(dict(record, url=url, md5=md5))
             self.exec_conda(f"env remove --prefix {tmpdir} -y")
+        return records
+
+    def get_scratch_dir(self) -> str:
+        """
+        Return the directory for temporary prefixes. Unless given as
+        scratch_dir, this is a directory inside the first writable package
+        cache, such that conda can hardlink packages instead of copying them.
+        """
+        if self.scratch_dir is not None:
+            os.makedirs(self.scratch_dir, exist_ok=True)
+            return self.scratch_dir
+        for pkgs_dir in self.info.get("pkgs_dirs", []):
+            # hidden, such that conda does not take it for a package
+            scratch_dir = os.path.join(pkgs_dir, ".snakedeploy")
+            try:
+                os.makedirs(scratch_dir, exist_ok=True)
+            except OSError:
+                continue
+            if os.access(scratch_dir, os.W_OK):
+                return scratch_dir
+        return "."
+
+    def format_explicit(self, records: List[Dict]) -> str:
+        """
+        Return an explicit spec file of the given records, as written by
+        conda list --explicit --md5.
+        """
+        lines = [
+            "# This file may be used to create an environment using:",
+            "# $ conda create --name <env> --file <this file>",
+            f"# platform: {self.info['platform']}",
+        ]
+        if self.info.get("conda_version"):
+            lines.append(f"# created-by: conda {self.info['conda_version']}")
+        lines.append("@EXPLICIT")
+        lines.extend(f"{record['url']}#{record['md5']}" for record in records)
+        return "\n".join(lines) + "\n"
 
     def exec_conda(self, subcmd):
-        return sp.run(
-            f"{self.conda_frontend} {subcmd}",
-            shell=True,
-            stderr=sp.PIPE,
-            stdout=sp.PIPE,
-            universal_newlines=True,
-            check=True,
-        )
+        # name the span after the subcommand, e.g. "exec_conda env create"
+        words = []
+        for word in subcmd.split():
+            if word.startswith("-") or len(words) == 2:
+                break
+            words.append(word)
+        with logger.span(f"exec_conda {' '.join(words)}", cmd=subcmd):
+            return sp.run(
+                f"{self.conda_frontend} {subcmd}",
+                shell=True,
+                stderr=sp.PIPE,
+                stdout=sp.PIPE,
+                universal_newlines=True,
+                check=True,
+            )
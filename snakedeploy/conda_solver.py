@@ -0,0 +1,127 @@
+"""
+Solve conda envs on behalf of snakedeploy in a long-lived process.
+
+This script is run with the Python interpreter of conda (not the one of
+snakedeploy) and may therefore only use the standard library and conda
+itself. It reads one JSON request per line from stdin, i.e.
+
+    {"channels": [...], "override_channels": false, "specs": [...]}
+
+and writes one JSON response per line to stdout, containing either the
+package records of the solution in installation order ("records") or an
+error message ("error"). Channel metadata is loaded once per combination of
+channels and reused by all subsequent requests. This relies on a private
+method of conda-libmamba-solver. Hence, once started, the script first
+writes a line reporting whether metadata is reused ("memoized"), along with
+the reason if not ("reason").
+"""
+
+from contextlib import redirect_stdout
+import inspect
+import json
+import os
+import sys
+import tempfile
+
+# the parameters of the memoized method the index is keyed by
+MEMOIZED_PARAMS = {"channels", "conda_build_channels", "subdirs"}
+
+
+def get_solver_class(context):
+    """
+    Return the solver class to use, along with the reason why channel
+    metadata is not reused across requests (None if it is).
+    """
+    solver_class = context.plugin_manager.get_cached_solver_backend()
+    try:
+        from conda_libmamba_solver.solver import LibMambaSolver
+    except ImportError:
+        return solver_class, "conda-libmamba-solver is not installed"
+    if not issubclass(solver_class, LibMambaSolver):
+        return solver_class, f"the solver {solver_class.__name__} is not libmamba"
+    collect = getattr(solver_class, "_collect_all_metadata", None)
+    try:
+        params = set(inspect.signature(collect).parameters)
+    except (TypeError, ValueError):
+        params = set()
+    if not MEMOIZED_PARAMS <= params:
+        return solver_class, (
+            "this version of conda-libmamba-solver does not provide "
+            f"_collect_all_metadata({', '.join(sorted(MEMOIZED_PARAMS))}, ...)"
+        )
+
+    indexes = {}
+
+    class SessionSolver(solver_class):
+        # The index only depends on the channels and subdirs here, because
+        # all envs are solved into empty prefixes.
+        def _collect_all_metadata(self, channels, conda_build_channels, **kwargs):
+            key = (
+                tuple(map(str, channels)),
+                tuple(map(str, conda_build_channels)),
+                tuple(kwargs.get("subdirs") or ()),
+            )
+            if key not in indexes:
+                indexes[key] = super()._collect_all_metadata(
+                    channels=channels,
+                    conda_build_channels=conda_build_channels,
+                    **kwargs,
+                )
+            return indexes[key]
+
+    return SessionSolver, None
+
+
+def solve(context, solver_class, prefix, request):
+    from conda.models.channel import Channel
+    from conda.models.match_spec import MatchSpec
+    from conda.models.prefix_graph import PrefixGraph
+
+    # as with conda create --channel, the configured channels come last
+    channels = list(request["channels"])
+    if not request.get("override_channels"):
+        channels.extend(context.channels)
+    solver = solver_class(
+        prefix,
+        [Channel(channel) for channel in dict.fromkeys(channels)],
+        context.subdirs,
+        specs_to_add=[MatchSpec(spec) for spec in request["specs"]],
+        command="create",
+    )
+    records = PrefixGraph(solver.solve_final_state()).graph
+    return [dict(record.dump(), url=record.url, md5=record.md5) for record in records]
+
+
+def main():
+    from conda.base.context import context, reset_context
+
+    reset_context()
+    context.json = True
+    solver_class, reason = get_solver_class(context)
+    out = sys.stdout
+    if reason is not None:
+        print(f"Channel metadata is not reused: {reason}.", file=sys.stderr)
+    out.write(json.dumps({"memoized": reason is None, "reason": reason}) + "\n")
+    out.flush()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # the prefix is never created
+        prefix = os.path.join(tmpdir, "env")
+        for line in sys.stdin:
+            if not line.strip():
+                continue
+            try:
+                # conda reports progress on stdout, which is reserved for responses
+                with redirect_stdout(sys.stderr):
+                    response = {
+                        "records": solve(
+                            context, solver_class, prefix, json.loads(line)
+                        )
+                    }
+            except Exception as e:
+                response = {"error": f"{type(e).__name__}: {e}"}
+            out.write(json.dumps(response, default=str) + "\n")
+            out.flush()
+
+
+if __name__ == "__main__":
+    main()
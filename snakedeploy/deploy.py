@@ -1,16 +1,46 @@
+from collections import Counter, defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+import copy
+from functools import partial
+import csv
 import glob
+import hashlib
+import io
+import json
 import tempfile
 from pathlib import Path
 import os
 import shutil
-from typing import Dict, Optional
+import tarfile
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 
 from jinja2 import Environment, PackageLoader
 import yaml
 
-from snakedeploy.providers import get_provider
+from snakedeploy.cache import CloneCache
+from snakedeploy.schemas import (
+    TABLE_SEPARATORS,
+    SchemaCache,
+    SchemaSource,
+    load_yaml,
+)
+from snakedeploy.providers import (
+    BUNDLE_MANIFEST,
+    LICENSE_VARIANTS,
+    get_provider,
+    iter_deploy_files,
+)
 from snakedeploy.logger import logger
 from snakedeploy.exceptions import UserError
+from snakedeploy.utils import get_copy_function, get_file_hash, sync_file, sync_tree
+
+# records source, resolved commit and file hashes of a deployment
+LOCKFILE = ".snakedeploy.lock"
+
+# shared by all deployers, parsed schemas are reused across deployments
+schema_cache = SchemaCache()
 
 
 class WorkflowDeployer:
@@ -21,20 +51,59 @@ class WorkflowDeployer:
         tag: Optional[str] = None,
         branch: Optional[str] = None,
         force=False,
+        cache: Optional[CloneCache] = None,
+        link_mode: str = "copy",
+        archive: bool = False,
+        update: bool = False,
+        validate: Sequence[str] = (),
     ):
-        self.provider = get_provider(source)
+        self.provider = get_provider(source, link_mode=link_mode)
         self.env = Environment(loader=PackageLoader("snakedeploy"))
         self.dest_path = dest
-        self.force = force
+        # an update overwrites existing files, but only if they differ
+        self.force = force or update
+        self.update = update
+        # with force, an update also restores deployments that are up to date
+        self.skip_up_to_date = update and not force
+        self.update_counts = Counter()
+        self._update_counts_lock = threading.Lock()
         self._cloned = None
+        self._repo_path = None
+        # hashes of the files in the clone, shared with the for_dest deployers
+        self._source_hashes = {}
+        self._source_hashes_lock = threading.Lock()
+        self.provider.check_ref(tag, branch)
         self.tag = tag
         self.branch = branch
+        if tag is None and branch is None:
+            # e.g. bundles know the ref they have been created from
+            self.tag, self.branch = self.provider.get_default_ref()
+        # the commit the source repository has been obtained at, if known
+        self.commit = None
+        self.cache = cache
+        self.link_mode = link_mode
+        self.archive = archive
+        # files to validate against the workflow schemas after deployment
+        self.validate = validate
+        # A clone is private to this deployer, hence it is safe to hardlink
+        # from it. Sources read in place and clones shared with other
+        # destinations (see for_dest) are never hardlinked.
+        self.copy_function = get_copy_function(link_mode)
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc, value, tb):
-        self._cloned.cleanup()
+        if self._cloned is not None:
+            self._cloned.cleanup()
+
+    def count_update(self, counts: Counter):
+        with self._update_counts_lock:
+            self.update_counts.update(counts)
+
+    @property
+    def ref(self):
+        return self.tag if self.tag is not None else self.branch
 
     @property
     def snakefile(self):
@@ -48,6 +117,11 @@ class WorkflowDeployer:
     def profiles(self):
         return self.dest_path / "profiles"
 
+    @property
+    def lockfile(self):
+        return self.dest_path / LOCKFILE
+
+    @logger.timed()
     def deploy_config(self):
         """
         Deploy the config directory, either using an existing or creating a dummy.
@@ -72,9 +146,20 @@ class WorkflowDeployer:
                     pass
         else:
             logger.info("Writing template configuration...")
-            shutil.copytree(config_dir, self.config, dirs_exist_ok=self.force)
+            if self.update:
+                self.count_update(
+                    sync_tree(config_dir, self.config, self.copy_function)
+                )
+            else:
+                shutil.copytree(
+                    config_dir,
+                    self.config,
+                    dirs_exist_ok=self.force,
+                    copy_function=self.copy_function,
+                )
         return no_config
 
+    @logger.timed()
     def deploy_profile(self):
         """
         Deploy the profile directory if it exists
@@ -92,34 +177,27 @@ class WorkflowDeployer:
             )
         else:
             logger.info("Writing template profiles")
-            shutil.copytree(profile_dir, self.profiles, dirs_exist_ok=self.force)
+            if self.update:
+                self.count_update(
+                    sync_tree(profile_dir, self.profiles, self.copy_function)
+                )
+            else:
+                shutil.copytree(
+                    profile_dir,
+                    self.profiles,
+                    dirs_exist_ok=self.force,
+                    copy_function=self.copy_function,
+                )
         return no_profile
 
+    @logger.timed()
     def deploy_license(self):
         """
         Deploy the license file if it exists
 
         returns a boolean "no_license" to indicate if there is no license (True)
         """
-        # List possible license file names and extensions
-        license_variants = [
-            "license*",
-            "License*",
-            "LICENSE*",
-            "licence*",
-            "Licence*",
-            "LICENCE*",
-        ]
-        licenses = []  # licenses found
-
-        # Iterate over the variants and check if a license file exists in the directory
-        for variant in license_variants:
-            # Use glob to match files with any extension
-            matching_files = glob.glob(os.path.join(self.repo_clone, variant))
-            if matching_files:
-                licenses.extend(matching_files)
-
-        license_file = Path(licenses[0]) if len(licenses) != 0 else None
+        license_file = self.find_license()
         if license_file is None:
             no_license = True
         else:
@@ -129,39 +207,135 @@ class WorkflowDeployer:
             pass
         else:
             logger.info("Writing license")
-            shutil.copy(license_file, self.dest_path)
+            target = self.dest_path / license_file.name
+            if self.update:
+                self.count_update(
+                    Counter([sync_file(license_file, target, self.copy_function)])
+                )
+            else:
+                self.copy_function(license_file, target)
         return no_license
 
+    def find_license(self) -> Optional[Path]:
+        licenses = []  # licenses found
+
+        # Iterate over the variants and check if a license file exists in the directory
+        for variant in LICENSE_VARIANTS:
+            # Use glob to match files with any extension
+            matching_files = glob.glob(os.path.join(self.repo_clone, variant))
+            if matching_files:
+                licenses.extend(matching_files)
+
+        return Path(licenses[0]) if len(licenses) != 0 else None
+
     @property
     def repo_clone(self):
-        if self._cloned is None:
-            logger.info("Obtaining source repository...")
-            self._cloned = tempfile.TemporaryDirectory()
-            self.provider.clone(self._cloned.name)
-            if self.tag is not None:
-                self.provider.checkout(self._cloned.name, self.tag)
-            elif self.branch is not None:
-                self.provider.checkout(self._cloned.name, self.branch)
+        if self._repo_path is None:
+            local_path = self.provider.get_local_path()
+            if local_path is not None:
+                logger.info("Reading source repository in place...")
+                # the files belong to the user, never hardlink them
+                self.copy_function = get_copy_function(
+                    self.link_mode, allow_hardlink=False
+                )
+                self._repo_path = local_path
+                self.commit = self.provider.get_commit(local_path)
+                return self._repo_path
 
-        return self._cloned.name
+            # Resolve the ref remotely first (if possible), in order to fail
+            # early for unknown refs and to obtain exactly that commit.
+            self.commit = self.provider.resolve_ref(self.ref)
+            ref = self.commit or self.ref
 
+            logger.info("Obtaining source repository...")
+            with logger.span(
+                "WorkflowDeployer.repo_clone", source=self.provider.source_url, ref=ref
+            ):
+                self._cloned = tempfile.TemporaryDirectory()
+                if self.archive:
+                    self.provider.download_archive(self._cloned.name, ref=ref)
+                elif self.cache is not None and self.provider.cacheable:
+                    self.commit = self.cache.materialize(
+                        self.provider.source_url, ref, self._cloned.name
+                    )
+                else:
+                    self.provider.clone(self._cloned.name, ref=ref)
+            self._repo_path = self._cloned.name
+            if self.commit is None:
+                self.commit = self.provider.get_commit(self._repo_path)
+
+        return self._repo_path
+
+    def for_dest(self, dest: Path):
+        """
+        Return a deployer for another destination that shares provider,
+        templates and the clone of the source repository with this one.
+        The clone is cleaned up with this deployer. In order to share it,
+        obtain it (via repo_clone) before calling this.
+        """
+        deployer = copy.copy(self)
+        deployer.dest_path = dest
+        # hardlinks would alias the files of all destinations sharing the clone
+        deployer.copy_function = get_copy_function(self.link_mode, allow_hardlink=False)
+        deployer._update_counts_lock = threading.Lock()
+        return deployer
+
+    @logger.timed()
     def deploy(self, name: str):
         """
         Deploy a source to a destination.
+
+        The individual steps are independent of each other once the source
+        repository has been obtained, hence they run in parallel. Errors of
+        all steps are collected and reported together.
         """
         self.check()
-
-        # Either copy existing config or create a dummy config
-        no_config = self.deploy_config()
-
-        # Copy profile directory if it exists, see issue #64
-        self.deploy_profile()
-
-        # Copy license if it exists
-        self.deploy_license()
-
-        # Inspect repository to find existing snakefile
-        self.deploy_snakefile(self.repo_clone, name)
+        self.update_counts = Counter()
+        if self.skip_up_to_date and self.is_up_to_date(name):
+            logger.info(
+                f"{self.dest_path} is up to date with {self.provider.source_url} "
+                f"at {self.commit}, skipping."
+            )
+            if self.validate:
+                self.validate_files(self.validate)
+            return
+
+        # Obtain the source before fanning out, the steps only read from it.
+        repo_clone = self.repo_clone
+        os.makedirs(self.dest_path, exist_ok=True)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            steps = {
+                # Either copy existing config or create a dummy config
+                "config": executor.submit(self.deploy_config),
+                # Copy profile directory if it exists, see issue #64
+                "profiles": executor.submit(self.deploy_profile),
+                # Copy license if it exists
+                "license": executor.submit(self.deploy_license),
+                # Inspect repository to find existing snakefile
+                "Snakefile": executor.submit(self.deploy_snakefile, repo_clone, name),
+            }
+        errors = []
+        for step, future in steps.items():
+            e = future.exception()
+            if e is None:
+                continue
+            if not isinstance(e, (UserError, OSError)):
+                raise e
+            errors.append(f"Failed to deploy {step}: {e}")
+        if errors:
+            raise UserError("\n".join(errors))
+        no_config = steps["config"].result()
+        self.write_lockfile(name)
+        if self.validate:
+            self.validate_files(self.validate)
+
+        if self.update:
+            logger.info(
+                f"Updated {self.dest_path}: {self.update_counts['added']} added, "
+                f"{self.update_counts['changed']} changed, "
+                f"{self.update_counts['unchanged']} unchanged files."
+            )
 
         logger.info(
             self.env.get_template("post-instructions.txt.jinja").render(
@@ -169,6 +343,102 @@ class WorkflowDeployer:
             )
         )
 
+    def deployed_files(self) -> Iterator[Tuple[str, Optional[Path]]]:
+        """
+        Yield the paths of all files deployed from the source repository,
+        relative to the destination, along with the files in the clone they
+        are copied from (None for files created during deployment).
+        """
+        root = Path(self.repo_clone)
+        if not (root / "config").exists():
+            yield os.path.join("config", "config.yaml"), None
+        for directory in ["config", "profiles"]:
+            for dirpath, _, files in os.walk(root / directory):
+                for f in files:
+                    source = Path(dirpath) / f
+                    yield os.path.relpath(source, root), source
+        license_file = self.find_license()
+        if license_file is not None:
+            yield license_file.name, license_file
+        yield os.path.join("workflow", "Snakefile"), None
+
+    def get_file_hashes(self) -> Dict[str, str]:
+        """
+        Return the hashes of all deployed files (see deployed_files). Files
+        copied from the clone are hashed only once for all deployers sharing
+        it (see for_dest).
+        """
+        files = list(self.deployed_files())
+        with self._source_hashes_lock:
+            source_hashes = self._source_hashes.get(self.repo_clone)
+            if source_hashes is None:
+                source_hashes = {
+                    path: get_file_hash(source)
+                    for path, source in files
+                    if source is not None
+                }
+                self._source_hashes[self.repo_clone] = source_hashes
+        return {
+            path: source_hashes.get(path) or get_file_hash(self.dest_path / path)
+            for path, _ in files
+        }
+
+    @logger.timed()
+    def write_lockfile(self, name: Optional[str]):
+        """
+        Write the lockfile, recording the source, the ref, the commit it has
+        been resolved to and the hashes of all deployed files.
+        """
+        lock = {
+            "source_url": self.provider.source_url,
+            "tag": self.tag,
+            "branch": self.branch,
+            "name": name,
+            "commit": self.commit,
+            "files": dict(sorted(self.get_file_hashes().items())),
+        }
+        tmp_lockfile = self.lockfile.with_name(f"{LOCKFILE}.tmp")
+        with open(tmp_lockfile, "w") as f:
+            json.dump(lock, f, indent=2, sort_keys=True)
+            f.write("\n")
+        os.replace(tmp_lockfile, self.lockfile)
+
+    @logger.timed()
+    def is_up_to_date(self, name: Optional[str]) -> bool:
+        """
+        Return True if the lockfile of the destination records a deployment
+        of the same source and ref, the ref still resolves to the recorded
+        commit, all recorded files are present and the Snakefile has not been
+        modified. Modified config and profile files are kept, they are
+        restored with force. This only needs a remote lookup of the ref, the
+        source repository is not obtained.
+        """
+        try:
+            with open(self.lockfile) as f:
+                lock = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if (
+            not isinstance(lock, dict)
+            or lock.get("source_url") != self.provider.source_url
+            or lock.get("tag") != self.tag
+            or lock.get("branch") != self.branch
+            or lock.get("name") != name
+            or lock.get("commit") is None
+        ):
+            return False
+        files = lock.get("files", {})
+        if not all((self.dest_path / path).exists() for path in files):
+            return False
+        snakefile = os.path.join("workflow", "Snakefile")
+        if files.get(snakefile) != get_file_hash(self.dest_path / snakefile):
+            return False
+        commit = self.provider.resolve_ref(self.ref)
+        if commit is None or commit != lock["commit"]:
+            return False
+        self.commit = commit
+        return True
+
     def check(self):
         """
         Check to ensure we haven't already deployed to the destination.
@@ -188,6 +458,7 @@ class WorkflowDeployer:
                 f"{self.profiles} already exists, aborting (use --force to overwrite)"
             )
 
+    @logger.timed()
     def deploy_snakefile(self, tmpdir: str, name: str):
         """
         Deploy the Snakefile to workflow/Snakefile
@@ -232,18 +503,86 @@ class WorkflowDeployer:
             repo=self.provider.source_url,
             config=config,
         )
+        module_deployment += "\n"
+        if self.update:
+            if not self.snakefile.exists():
+                self.count_update(Counter(["added"]))
+            elif self.snakefile.read_text() == module_deployment:
+                self.count_update(Counter(["unchanged"]))
+                return
+            else:
+                self.count_update(Counter(["changed"]))
         with open(self.snakefile, "w") as f:
-            print(module_deployment, file=f)
+            f.write(module_deployment)
+
+    @property
+    def schema_source(self) -> SchemaSource:
+        """
+        The schemas of the source repository. Unless the repository has
+        already been obtained, schema files are downloaded individually
+        (if supported by the provider) instead of obtaining the repository,
+        which is only obtained if the schemas are not cached yet otherwise.
+        """
+        if self._repo_path is None and self.provider.get_local_path() is None:
+            commit = self.provider.resolve_ref(self.ref)
+            if commit is not None:
+                if self.provider.supports_raw_files():
+                    fetch = partial(self.provider.fetch_raw_files, ref=commit)
+                else:
+                    fetch = self.read_from_clone
+                return SchemaSource(commit, fetch=fetch)
+        root = self.repo_clone
+        # files of a source that is read in place may differ from its commit
+        if self.provider.get_local_path() is not None:
+            return SchemaSource(None, root=root)
+        return SchemaSource(self.commit, root=root)
+
+    def read_from_clone(self, paths: List[str]) -> Dict[str, Optional[bytes]]:
+        return SchemaSource(self.commit, root=self.repo_clone).read(paths)
 
     def get_json_schema(self, item: str) -> Optional[Dict]:
         """Get schema under workflow/schemas/{item}.schema.{yaml|yml|json} as
-        python dict."""
-        clone = Path(self.repo_clone)
-        for ext in ["yaml", "yml", "json"]:
-            path = clone / "workflow" / "schemas" / f"{item}.schema.{ext}"
-            if path.exists():
-                return yaml.safe_load(path.read_text())
-        return None
+        python dict. Parsed schemas are cached per commit and item."""
+        return schema_cache.get(self.schema_source, item)
+
+    def validate_config(self, config: Dict, item: str = "config"):
+        """
+        Validate the given (parsed) configuration against the schema of the
+        given item (e.g. config or samples) of the workflow. The compiled
+        validator is reused across calls. Raises a UserError listing all
+        violations.
+        """
+        schema_cache.validate(self.schema_source, item, config)
+
+    @logger.timed()
+    def validate_files(self, paths: Iterable[str]):
+        """
+        Validate the given files (relative to the destination) against the
+        workflow schema named after their file name, e.g. config/config.yaml
+        against workflow/schemas/config.schema.yaml and config/samples.tsv
+        against workflow/schemas/samples.schema.yaml. Sample sheets (TSV or
+        CSV) are validated row by row in chunks. Violations of all files are
+        reported together in a UserError.
+        """
+        source = self.schema_source
+        errors = []
+        for path in paths:
+            path = self.dest_path / path
+            item = path.name.split(".")[0]
+            logger.info(f"Validating {path} against the {item} schema...")
+            try:
+                if path.suffix in TABLE_SEPARATORS:
+                    schema_cache.validate_table(source, item, path)
+                else:
+                    try:
+                        config = load_yaml(path)
+                    except (OSError, yaml.YAMLError) as e:
+                        raise UserError(f"Failed to read {path}: {e}")
+                    schema_cache.validate(source, item, config)
+            except UserError as e:
+                errors.append(str(e))
+        if errors:
+            raise UserError("\n".join(errors))
 
 
 def deploy(
@@ -253,9 +592,27 @@ def deploy(
     branch: Optional[str],
     dest_path: Path,
     force=False,
+    cache: Optional[CloneCache] = None,
+    link_mode: str = "copy",
+    archive: bool = False,
+    update: bool = False,
+    validate: Sequence[str] = (),
 ):
     """
     Deploy a given workflow to the local machine, using the Snakemake module system.
+    If a CloneCache is given, the source repository is obtained from (and
+    stored in) that persistent cache instead of being cloned from scratch.
+    With archive=True, it is instead obtained via an archive download over
+    HTTPS (GitHub and GitLab only), without using git.
+    The link_mode (copy, hardlink, reflink or auto) determines how config
+    and profile files are put into place. With update=True, an existing
+    deployment is updated, only writing files whose content differs.
+    Each deployment records source, ref, resolved commit and file hashes in
+    a .snakedeploy.lock file in dest_path. Unless force is given, an update
+    is skipped entirely if the ref still resolves to the recorded commit
+    (see WorkflowDeployer.is_up_to_date). The files given in
+    validate (relative to dest_path) are validated against the schemas of
+    the workflow afterwards (see WorkflowDeployer.validate_files).
 
     Example
     =======
@@ -275,6 +632,222 @@ def deploy(
 
     """
     with WorkflowDeployer(
-        source=source_url, dest=dest_path, tag=tag, branch=branch, force=force
+        source=source_url,
+        dest=dest_path,
+        tag=tag,
+        branch=branch,
+        force=force,
+        cache=cache,
+        link_mode=link_mode,
+        archive=archive,
+        update=update,
+        validate=validate,
     ) as sd:
         sd.deploy(name=name)
+
+
+DeployTarget = namedtuple("DeployTarget", "repo dest tag branch name")
+
+
+def read_manifest(manifest_path: str) -> List[DeployTarget]:
+    """
+    Read deployment targets from a TSV file with the columns repo, dest,
+    tag, branch and (optionally) name. Either tag or branch has to be given
+    in each row.
+    """
+    targets = []
+    with open(manifest_path, newline="") as manifest:
+        reader = csv.DictReader(manifest, delimiter="\t")
+        missing = {"repo", "dest"} - set(reader.fieldnames or [])
+        if missing:
+            raise UserError(
+                f"Manifest {manifest_path} lacks the column(s) {', '.join(missing)}."
+            )
+        for i, row in enumerate(reader, start=2):
+            target = DeployTarget(
+                repo=row["repo"],
+                dest=Path(row["dest"]),
+                tag=row.get("tag") or None,
+                branch=row.get("branch") or None,
+                name=row.get("name") or None,
+            )
+            if not (target.tag or target.branch):
+                raise UserError(
+                    f"Manifest {manifest_path}, line {i}: "
+                    "either tag or branch has to be specified."
+                )
+            targets.append(target)
+    return targets
+
+
+@logger.timed()
+def deploy_many(
+    targets: Iterable[DeployTarget],
+    force=False,
+    cache: Optional[CloneCache] = None,
+    jobs: Optional[int] = None,
+    link_mode: str = "copy",
+    archive: bool = False,
+    update: bool = False,
+    validate: Sequence[str] = (),
+):
+    """
+    Deploy many workflows at once. Targets sharing the same repository and
+    ref are deployed from a single clone, and the deployment into the
+    individual destinations happens in a pool of jobs threads. With
+    update=True, destinations that are up to date according to their
+    lockfile are skipped, and the source is only obtained if needed. The
+    files given in validate are validated in each destination.
+
+    Example
+    =======
+
+    .. code-block:: python
+
+       from snakedeploy.deploy import DeployTarget, deploy_many
+       deploy_many(
+           [
+               DeployTarget(
+                   "https://github.com/snakemake-workflows/dna-seq-varlociraptor",
+                   dest=f"/tmp/{cohort}",
+                   tag="v1.0.0",
+                   branch=None,
+                   name="dna_seq",
+               )
+               for cohort in ["cohort1", "cohort2"]
+           ]
+       )
+
+    """
+    groups = defaultdict(list)
+    for target in targets:
+        groups[(target.repo, target.tag, target.branch)].append(target)
+
+    failed = []
+    with ExitStack() as stack, ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = []
+        for (repo, tag, branch), group in groups.items():
+            try:
+                source = stack.enter_context(
+                    WorkflowDeployer(
+                        source=repo,
+                        dest=Path(group[0].dest),
+                        tag=tag,
+                        branch=branch,
+                        force=force,
+                        cache=cache,
+                        link_mode=link_mode,
+                        archive=archive,
+                        update=update,
+                        validate=validate,
+                    )
+                )
+                if update and not force and not validate:
+                    # skip up to date destinations before obtaining the source
+                    group = [
+                        target
+                        for target in group
+                        if not _skip_up_to_date(
+                            source.for_dest(Path(target.dest)), target
+                        )
+                    ]
+                    if not group:
+                        continue
+                source.repo_clone
+            except UserError as e:
+                # the other groups are deployed nevertheless
+                for target in group:
+                    logger.error(
+                        f"Deployment of {target.repo} to {target.dest} failed: {e}"
+                    )
+                failed.extend(group)
+                continue
+            for target in group:
+                deployer = source.for_dest(Path(target.dest))
+                futures.append(
+                    (target, executor.submit(deployer.deploy, name=target.name))
+                )
+        for target, future in futures:
+            try:
+                future.result()
+            except UserError as e:
+                logger.error(
+                    f"Deployment of {target.repo} to {target.dest} failed: {e}"
+                )
+                failed.append(target)
+    if failed:
+        total = sum(len(group) for group in groups.values())
+        raise UserError(f"{len(failed)} of {total} deployments failed, see above.")
+
+
+def _skip_up_to_date(deployer: WorkflowDeployer, target: DeployTarget) -> bool:
+    if deployer.is_up_to_date(target.name):
+        logger.info(f"{target.dest} is up to date, skipping.")
+        return True
+    return False
+
+
+@logger.timed()
+def bundle_workflow(
+    source_url: str,
+    output: Path,
+    tag: Optional[str] = None,
+    branch: Optional[str] = None,
+    cache: Optional[CloneCache] = None,
+    archive: bool = False,
+) -> Path:
+    """
+    Write an offline bundle of everything that is needed to deploy the given
+    workflow: config, profiles, license, Snakefile and schemas, together with
+    the source URL, ref and resolved commit. The bundle can be deployed
+    without network access by passing it (as bundle://<path> or
+    <path>.sdbundle) to deploy. If output is a directory, the bundle is
+    written into it, named after repository, ref and content hash.
+    Returns the path of the written bundle.
+    """
+    with WorkflowDeployer(
+        source=source_url,
+        dest=output,
+        tag=tag,
+        branch=branch,
+        cache=cache,
+        archive=archive,
+    ) as deployer:
+        root = deployer.repo_clone
+        files = {
+            path: get_file_hash(os.path.join(root, path))
+            for path in iter_deploy_files(root)
+        }
+        manifest = {
+            "source_url": deployer.provider.source_url,
+            "tag": tag,
+            "branch": branch,
+            "commit": deployer.commit,
+            "files": files,
+        }
+        manifest_content = json.dumps(manifest, indent=2, sort_keys=True).encode()
+        digest = hashlib.sha256(manifest_content).hexdigest()
+        if output.is_dir():
+            ref = (deployer.ref or "HEAD").replace("/", "-")
+            output = (
+                output
+                / f"{deployer.provider.get_repo_name()}-{ref}-{digest[:12]}.sdbundle"
+            )
+
+        logger.info(f"Writing bundle {output}...")
+        tmp_output = output.with_name(f".{output.name}.tmp")
+        with tarfile.open(tmp_output, "w:gz") as bundle:
+            # the manifest comes first, so that it can be read quickly
+            info = tarfile.TarInfo(BUNDLE_MANIFEST)
+            info.size = len(manifest_content)
+            bundle.addfile(info, io.BytesIO(manifest_content))
+            for path in files:
+                bundle.add(os.path.join(root, path), arcname=path, filter=_reset_owner)
+        os.replace(tmp_output, output)
+    return output
+
+
+def _reset_owner(info: tarfile.TarInfo) -> tarfile.TarInfo:
+    info.uid = info.gid = 0
+    info.uname = info.gname = ""
+    return info
@@ -2,11 +2,15 @@ __author__ = "Vanessa Sochat"
 __copyright__ = "Copyright 2020-2021, Vanessa Sochat"
 __license__ = "MPL 2.0"
 
+from contextlib import contextmanager
+import functools
+import json
 import logging as _logging
 import platform
 import sys
 import os
 import threading
+import time
 import inspect
 
 
@@ -73,6 +77,10 @@ class Logger:
         self.logfile = None
         self.last_msg_was_job_info = False
         self.logfile_handler = None
+        # recorded spans (see span()), None if profiling is disabled
+        self.spans = None
+        self._spans_lock = threading.Lock()
+        self._epoch = time.perf_counter_ns()
 
     def cleanup(self):
         if self.logfile_handler is not None:
@@ -125,6 +133,75 @@ class Logger:
             msg = dict(level="shellcmd", msg=msg)
             self.handler(msg)
 
+    def enable_profiling(self):
+        """Start recording the spans of all subsequent operations."""
+        self.spans = []
+
+    @contextmanager
+    def span(self, name, **args):
+        """
+        Record the duration of the enclosed block under the given name, with
+        args as additional information. Does nothing unless profiling has
+        been enabled.
+        """
+        if self.spans is None:
+            yield
+            return
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            end = time.perf_counter_ns()
+            with self._spans_lock:
+                self.spans.append(
+                    dict(
+                        name=name,
+                        start=start - self._epoch,
+                        end=end - self._epoch,
+                        pid=os.getpid(),
+                        tid=threading.get_native_id(),
+                        args=args,
+                    )
+                )
+            self.debug(f"{name} took {(end - start) / 1e9:.3f}s")
+
+    def timed(self, name=None):
+        """Decorator recording a span for each call of the decorated function."""
+
+        def decorator(func):
+            span_name = name or func.__qualname__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(span_name):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def write_trace(self, path):
+        """
+        Write the recorded spans as trace in the Chrome trace event format
+        (loadable with e.g. chrome://tracing or https://ui.perfetto.dev).
+        """
+        events = [
+            dict(
+                name=span["name"],
+                cat="snakedeploy",
+                ph="X",
+                # microseconds since the start of snakedeploy
+                ts=span["start"] / 1000,
+                dur=(span["end"] - span["start"]) / 1000,
+                pid=span["pid"],
+                tid=span["tid"],
+                args=span["args"],
+            )
+            for span in sorted(self.spans or [], key=lambda span: span["start"])
+        ]
+        with open(path, "w") as f:
+            json.dump(dict(traceEvents=events, displayTimeUnit="ms"), f, default=str)
+
     def text_handler(self, msg):
         """The default snakemake log handler.
         Prints the output to the console.
@@ -1,21 +1,158 @@
 from abc import abstractmethod, ABC
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatchcase
+from functools import partial
+import gzip
+import json
 from shutil import copytree
 import shutil
+import tarfile
+import tempfile
+from typing import IO, Dict, Iterable, Iterator, Optional
+from urllib.parse import quote, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
 from snakedeploy.exceptions import UserError
+from snakedeploy.logger import logger
+from snakedeploy.utils import get_copy_function, get_file_hash
 import subprocess as sp
 import os
+import re
+import threading
+import time
+import zlib
+
+# Possible license file names (with any extension) at the repository root.
+LICENSE_VARIANTS = [
+    "license*",
+    "License*",
+    "LICENSE*",
+    "licence*",
+    "Licence*",
+    "LICENCE*",
+]
+
+# Sparse checkout patterns (relative to the repository root) for everything
+# that is read during a deployment. Nothing else has to be downloaded.
+DEPLOY_PATTERNS = [
+    "/config/",
+    "/profiles/",
+    "/workflow/Snakefile",
+    "/workflow/schemas/",
+    "/Snakefile",
+] + [f"/{variant}" for variant in LICENSE_VARIANTS]
+
+# Name of the manifest inside of bundles written by snakedeploy bundle-workflow.
+BUNDLE_MANIFEST = "snakedeploy-bundle.json"
+
+# Maximum number of concurrent downloads (and pooled connections per host).
+HTTP_JOBS = 16
+_session = None
+_session_lock = threading.Lock()
+
+# Seconds for which a ref resolved via git ls-remote is reused (per source URL and ref).
+REF_CACHE_TTL = 60
+_resolved_refs = {}
+_resolved_refs_lock = threading.Lock()
+
+COMMIT_RE = re.compile("^[0-9a-f]{40}$")
+# commit hashes as abbreviated by git (at least 7 characters)
+ABBREV_COMMIT_RE = re.compile("^[0-9a-f]{7,40}$")
+
+
+def is_deploy_path(path: str) -> bool:
+    """Return True if the given repository relative path matches DEPLOY_PATTERNS."""
+    path = "/" + path.strip("/")
+    for pattern in DEPLOY_PATTERNS:
+        if pattern.endswith("/"):
+            if path.startswith(pattern) or path == pattern[:-1]:
+                return True
+        elif fnmatchcase(path, pattern) and path.count("/") == pattern.count("/"):
+            return True
+    return False
+
+
+def iter_deploy_files(root: str) -> Iterator[str]:
+    """
+    Yield the (repository relative) paths of all files below root that match
+    DEPLOY_PATTERNS, without descending into unrelated directories.
+    """
+    for entry in sorted(os.listdir(root)):
+        path = os.path.join(root, entry)
+        if not os.path.isdir(path):
+            if is_deploy_path(entry):
+                yield entry
+            continue
+        if not any(pattern.startswith(f"/{entry}/") for pattern in DEPLOY_PATTERNS):
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                relpath = os.path.relpath(os.path.join(dirpath, filename), root)
+                relpath = relpath.replace(os.sep, "/")
+                if is_deploy_path(relpath):
+                    yield relpath
 
 
-def get_provider(source_url):
+def extract_deploy_members(
+    fileobj: IO[bytes], dest: str, mode: str = "r|", strip_components: int = 0
+):
+    """
+    Extract the members of a (streamed) tar archive that are needed for
+    deployment into dest, skipping everything else.
+    """
+    with tarfile.open(fileobj=fileobj, mode=mode) as archive:
+        if hasattr(tarfile, "data_filter"):
+            archive.extraction_filter = tarfile.data_filter
+        for member in archive:
+            parts = member.name.split("/")[strip_components:]
+            if not parts or not (member.isfile() or member.isdir()):
+                continue
+            member.name = "/".join(parts)
+            if is_deploy_path(member.name):
+                archive.extract(member, dest)
+
+
+def get_session() -> requests.Session:
+    """
+    Return the HTTP session shared by all providers. Connections are kept
+    alive and pooled per host, and failed requests are retried with
+    exponential backoff.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=5,
+                backoff_factor=0.3,
+                status_forcelist=(429, 500, 502, 503, 504),
+            )
+            adapter = HTTPAdapter(
+                pool_connections=HTTP_JOBS, pool_maxsize=HTTP_JOBS, max_retries=retry
+            )
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def get_provider(source_url, link_mode="copy"):
     for provider in PROVIDERS:
         if provider.matches(source_url):
-            return provider(source_url)
+            return provider(source_url, link_mode=link_mode)
 
     raise UserError("No matching provider for source url %s" % source_url)
 
 
 class Provider(ABC):
-    def __init__(self, source_url):
+    # whether the source can be mirrored by snakedeploy.cache.CloneCache
+    cacheable = True
+
+    def __init__(self, source_url, link_mode="copy"):
         if not (
             source_url.startswith("https://")
             or source_url.startswith("file:")
@@ -28,13 +165,14 @@ class Provider(ABC):
         if source_url.endswith(".git"):
             source_url = source_url[:-4]
         self.source_url = source_url
+        self.link_mode = link_mode
 
     @classmethod
     @abstractmethod
     def matches(cls, source_url: str): ...
 
     @abstractmethod
-    def clone(self, path: str): ...
+    def clone(self, path: str, ref: Optional[str] = None): ...
 
     @abstractmethod
     def checkout(self, path: str, ref: str): ...
@@ -42,25 +180,111 @@ class Provider(ABC):
     @abstractmethod
     def get_raw_file(self, path: str, tag: str): ...
 
+    def get_local_path(self) -> Optional[str]:
+        """
+        Return a directory from which the source can be read in place
+        (without cloning), or None if the source has to be cloned.
+        """
+        return None
+
+    def supports_raw_files(self) -> bool:
+        """Return True if single files can be downloaded via fetch_raw_files."""
+        return False
+
+    @logger.timed()
+    def fetch_raw_files(
+        self, paths: Iterable[str], ref: str
+    ) -> Dict[str, Optional[bytes]]:
+        """
+        Download the given files (relative to the repository root) at the
+        given ref concurrently, without obtaining the repository. Returns
+        their contents, None for files that do not exist.
+        """
+        paths = list(paths)
+        with ThreadPoolExecutor(max_workers=HTTP_JOBS) as executor:
+            contents = executor.map(partial(self.fetch_raw_file, ref=ref), paths)
+            return dict(zip(paths, contents))
+
+    def fetch_raw_file(self, path: str, ref: str) -> Optional[bytes]:
+        url = self.get_raw_file(path, ref)
+        try:
+            response = get_session().get(url, timeout=60)
+            if response.status_code == 404:
+                return None
+            response.raise_for_status()
+        except requests.RequestException as e:
+            raise UserError(f"Failed to download {path} of ref {ref} from {url}:\n{e}")
+        return response.content
+
+    def download_archive(self, path: str, ref: Optional[str] = None):
+        raise UserError(
+            f"Obtaining {self.source_url} via an archive download is not supported."
+        )
+
+    def get_default_ref(self):
+        """Return tag and branch to use if none are specified."""
+        return None, None
+
+    def check_ref(self, tag: Optional[str], branch: Optional[str]):
+        """Raise a UserError if the given tag or branch cannot be deployed."""
+        pass
+
+    def resolve_ref(self, ref: Optional[str]) -> Optional[str]:
+        """
+        Resolve the given ref to a commit without obtaining the repository,
+        or return None if that is not possible for this provider.
+        """
+        return None
+
+    def get_commit(self, path: str) -> Optional[str]:
+        """Return the commit checked out at the given clone path, if known."""
+        if not os.path.exists(os.path.join(path, ".git")):
+            return None
+        try:
+            return sp.run(
+                ["git", "rev-parse", "HEAD"],
+                cwd=path,
+                check=True,
+                stdout=sp.PIPE,
+                stderr=sp.DEVNULL,
+                text=True,
+            ).stdout.strip()
+        except sp.CalledProcessError:
+            return None
+
     def get_repo_name(self):
         return self.source_url.split("/")[-1]
 
 
 class Local(Provider):
+    cacheable = False
+
     @classmethod
     def matches(cls, source_url: str):
         return os.path.exists(source_url)
 
-    def clone(self, tmpdir: str):
+    def get_local_path(self) -> Optional[str]:
+        # Deployment only reads from the source, hence it can happen in place.
+        return self.source_url
+
+    @logger.timed()
+    def clone(self, tmpdir: str, ref: Optional[str] = None):
         """
-        A local "clone" means moving files.
+        A local "clone" means copying (or linking, according to the link mode)
+        files. The ref is ignored, check out the branch you need beforehand.
+        Deployment reads local sources in place instead (see get_local_path).
         """
         if os.path.exists(tmpdir):
             try:
                 shutil.rmtree(tmpdir)
             except OSError as e:
                 raise UserError(f"Failed to remove existing directory {tmpdir}: {e}")
-        copytree(self.source_url, tmpdir)
+        # never hardlink automatically, the clone must not alias the source
+        copytree(
+            self.source_url,
+            tmpdir,
+            copy_function=get_copy_function(self.link_mode, allow_hardlink=False),
+        )
 
     def checkout(self, path: str, ref: str):
         # Local repositories don't need to check out anything
@@ -87,24 +311,191 @@ class Github(Provider):
     def name(self):
         return self.__class__.__name__.lower()
 
-    def clone(self, path: str):
+    @logger.timed()
+    def clone(self, path: str, ref: Optional[str] = None):
+        """
+        Clone the given ref (default: the remote HEAD) of the known source URL
+        to a temporary directory. Only the tip commit is fetched (depth 1) and
+        only the blobs matching DEPLOY_PATTERNS are downloaded (partial clone
+        with sparse checkout).
+        """
+        try:
+            sp.run(["git", "init", "--quiet"], cwd=path, check=True)
+            sp.run(
+                ["git", "remote", "add", "origin", self.source_url],
+                cwd=path,
+                check=True,
+            )
+            sp.run(
+                ["git", "sparse-checkout", "set", "--no-cone"] + DEPLOY_PATTERNS,
+                cwd=path,
+                check=True,
+            )
+        except sp.CalledProcessError as e:
+            raise UserError(f"Failed to clone repository {self.source_url}:\n{e}")
+        self.checkout(path, ref or "HEAD")
+
+    def get_remote_refs(self, ref: str) -> Dict[str, str]:
         """
-        Clone the known source URL to a temporary directory
+        Return a mapping of remote ref names to commits, as advertised by the
+        remote repository. Uses git ls-remote, or (if git is not available)
+        the ref advertisement of the smart HTTP protocol.
         """
+        if shutil.which("git") is None:
+            return self.get_remote_refs_http()
         try:
-            sp.run(["git", "clone", self.source_url, "."], cwd=path, check=True)
+            lines = sp.run(
+                ["git", "ls-remote", self.source_url, ref, f"{ref}^{{}}"],
+                check=True,
+                stdout=sp.PIPE,
+                text=True,
+            ).stdout.splitlines()
         except sp.CalledProcessError as e:
-            raise UserError("Failed to clone repository {}:\n{}", self.source_url, e)
+            raise UserError(f"Failed to query repository {self.source_url}:\n{e}")
+        return {
+            name: commit for commit, name in (line.split("\t", 1) for line in lines)
+        }
+
+    def get_remote_refs_http(self) -> Dict[str, str]:
+        url = f"{self.source_url}.git/info/refs"
+        try:
+            response = get_session().get(
+                url, params={"service": "git-upload-pack"}, timeout=60
+            )
+            response.raise_for_status()
+        except requests.RequestException as e:
+            raise UserError(f"Failed to query repository {self.source_url}:\n{e}")
+        remote_refs = {}
+        data, pos = response.content, 0
+        while pos + 4 <= len(data):
+            # pkt-line format: 4 hex digits of length (including themselves)
+            length = int(data[pos : pos + 4], 16)
+            line, pos = data[pos + 4 : pos + length], pos + max(length, 4)
+            line = line.rstrip(b"\n").split(b"\0", 1)[0].decode()
+            if not line or line.startswith("#"):
+                continue
+            commit, name = line.split(" ", 1)
+            remote_refs[name] = commit
+        return remote_refs
+
+    @logger.timed()
+    def resolve_ref(self, ref: Optional[str]) -> str:
+        """
+        Resolve the given tag or branch (default: HEAD) to a commit without
+        fetching anything, failing if it does not exist. Results are reused
+        for REF_CACHE_TTL seconds.
+        """
+        ref = ref or "HEAD"
+        if COMMIT_RE.match(ref):
+            return ref
+        key = (self.source_url, ref)
+        with _resolved_refs_lock:
+            cached = _resolved_refs.get(key)
+        if cached is not None and time.monotonic() - cached[1] < REF_CACHE_TTL:
+            return cached[0]
+
+        remote_refs = self.get_remote_refs(ref)
+        # prefer (peeled) tags over branches, like git does
+        for name in (f"refs/tags/{ref}^{{}}", f"refs/tags/{ref}", f"refs/heads/{ref}"):
+            if name in remote_refs:
+                commit = remote_refs[name]
+                break
+        else:
+            if ref in remote_refs:
+                commit = remote_refs[ref]
+            elif ABBREV_COMMIT_RE.match(ref):
+                commit = self.expand_commit(ref)
+            else:
+                raise UserError(f"Ref {ref} does not exist in {self.source_url}.")
+
+        with _resolved_refs_lock:
+            _resolved_refs[key] = (commit, time.monotonic())
+        return commit
+
+    @logger.timed()
+    def expand_commit(self, ref: str) -> str:
+        """
+        Return the full hash of the given abbreviated commit hash. Since the
+        remote cannot be asked for it, the history of all branches and tags
+        is fetched (without any files) into a temporary repository.
+        """
+        if shutil.which("git") is None:
+            raise UserError(
+                f"Ref {ref} looks like an abbreviated commit hash, which can only "
+                "be resolved with git. Please specify the full commit hash."
+            )
+        with tempfile.TemporaryDirectory() as path:
+            try:
+                sp.run(["git", "init", "--quiet", "--bare"], cwd=path, check=True)
+                sp.run(
+                    ["git", "fetch", "--quiet", "--filter=tree:0", self.source_url]
+                    + ["+refs/heads/*:refs/heads/*", "+refs/tags/*:refs/tags/*"],
+                    cwd=path,
+                    check=True,
+                    stderr=sp.PIPE,
+                )
+            except sp.CalledProcessError as e:
+                raise UserError(
+                    f"Failed to fetch history of {self.source_url}:\n{e.stderr}"
+                )
+            result = sp.run(
+                ["git", "rev-parse", "--verify", "--quiet", f"{ref}^{{commit}}"],
+                cwd=path,
+                stdout=sp.PIPE,
+                text=True,
+            )
+        if result.returncode != 0:
+            raise UserError(
+                f"Ref {ref} does not exist in {self.source_url} "
+                "(or is an ambiguous abbreviated commit hash)."
+            )
+        return result.stdout.strip()
 
+    @logger.timed()
     def checkout(self, path: str, ref: str):
         try:
-            sp.run(["git", "checkout", ref], cwd=path, check=True)
+            sp.run(
+                ["git", "fetch", "--quiet", "--depth", "1", "--filter=blob:none"]
+                + ["origin", ref],
+                cwd=path,
+                check=True,
+            )
+            sp.run(["git", "checkout", "--quiet", "FETCH_HEAD"], cwd=path, check=True)
         except sp.CalledProcessError as e:
-            raise UserError("Failed to checkout ref {}:\n{}", ref, e)
+            raise UserError(f"Failed to checkout ref {ref}:\n{e}")
+
+    def get_archive_url(self, ref: str):
+        url = urlparse(self.source_url)
+        if url.netloc == "github.com":
+            # avoid the redirect from github.com/<owner>/<repo>/archive
+            return f"https://codeload.github.com{url.path}/tar.gz/{quote(ref)}"
+        return f"{self.source_url}/archive/{quote(ref)}.tar.gz"
+
+    @logger.timed()
+    def download_archive(self, path: str, ref: Optional[str] = None):
+        """
+        Obtain the given ref (default: HEAD) via an archive download over HTTPS,
+        without using git. The archive is streamed and only the members
+        matching DEPLOY_PATTERNS are extracted into path.
+        """
+        ref = ref or "HEAD"
+        url = self.get_archive_url(ref)
+        try:
+            with get_session().get(url, stream=True, timeout=60) as response:
+                response.raise_for_status()
+                response.raw.decode_content = True
+                extract_deploy_members(
+                    response.raw, path, mode="r|*", strip_components=1
+                )
+        except (requests.RequestException, tarfile.TarError) as e:
+            raise UserError(f"Failed to download archive of ref {ref} from {url}:\n{e}")
 
     def get_raw_file(self, path: str, tag: str):
         return f"{self.source_url}/raw/{tag}/{path}"
 
+    def supports_raw_files(self) -> bool:
+        return urlparse(self.source_url).scheme in ("http", "https")
+
     def get_source_file_declaration(self, path: str, tag: str, branch: str):
         owner_repo = "/".join(self.source_url.split("/")[-2:])
         if not (tag or branch):
@@ -114,8 +505,110 @@ class Github(Provider):
 
 
 class Gitlab(Github):
+    def get_archive_url(self, ref: str):
+        ref = quote(ref, safe="")
+        return f"{self.source_url}/-/archive/{ref}/{self.get_repo_name()}.tar.gz"
+
     def get_raw_file(self, path: str, tag: str):
         return f"{self.source_url}/-/raw/{tag}/{path}"
 
 
-PROVIDERS = [Github, Gitlab, Local]
+class Bundle(Provider):
+    """
+    An offline bundle as written by snakedeploy bundle-workflow, given as
+    bundle://<path> or <path>.sdbundle. Deploying from it does not need any
+    network access and yields the same module declaration as deploying from
+    the bundled source repository.
+    """
+
+    cacheable = False
+
+    def __init__(self, source_url, link_mode="copy"):
+        path = source_url.removeprefix("bundle://")
+        if not os.path.exists(path):
+            raise UserError(f"Bundle {path} does not exist.")
+        self.path = path
+        self.link_mode = link_mode
+        try:
+            with tarfile.open(path, "r:gz") as bundle:
+                manifest = bundle.extractfile(BUNDLE_MANIFEST)
+                if manifest is None:
+                    # e.g. a directory
+                    raise KeyError(f"{BUNDLE_MANIFEST} is not a file")
+                self.manifest = json.load(manifest)
+        except (
+            tarfile.TarError,
+            gzip.BadGzipFile,
+            zlib.error,
+            EOFError,
+            KeyError,
+            ValueError,
+        ) as e:
+            raise UserError(f"Invalid bundle {path}: {e}")
+        self.source_url = self.manifest["source_url"]
+
+    @classmethod
+    def matches(cls, source_url: str):
+        return source_url.startswith("bundle://") or source_url.endswith(".sdbundle")
+
+    @logger.timed()
+    def clone(self, path: str, ref: Optional[str] = None):
+        """
+        Extract the bundle into the given directory, verifying the hashes of
+        all files. The ref is ignored, a bundle contains exactly one.
+        """
+        try:
+            with tarfile.open(self.path, "r:gz") as bundle:
+                if hasattr(tarfile, "data_filter"):
+                    bundle.extraction_filter = tarfile.data_filter
+                for member in bundle:
+                    if member.name in self.manifest["files"]:
+                        bundle.extract(member, path)
+        except (tarfile.TarError, gzip.BadGzipFile, zlib.error, EOFError) as e:
+            raise UserError(f"Bundle {self.path} is corrupted: {e}")
+        for relpath, checksum in self.manifest["files"].items():
+            target = os.path.join(path, relpath)
+            if not os.path.exists(target) or get_file_hash(target) != checksum:
+                raise UserError(f"Bundle {self.path} is corrupted: {relpath} differs.")
+
+    def checkout(self, path: str, ref: str):
+        # Bundles contain exactly one ref
+        pass
+
+    def get_raw_file(self, path: str, tag: str):
+        raise UserError("Raw files cannot be obtained from a bundle.")
+
+    def get_default_ref(self):
+        return self.manifest["tag"], self.manifest["branch"]
+
+    def check_ref(self, tag: Optional[str], branch: Optional[str]):
+        for kind, ref in [("tag", tag), ("branch", branch)]:
+            if ref is not None and ref != self.manifest[kind]:
+                raise UserError(
+                    f"Bundle {self.path} does not contain {kind} {ref}, it has been "
+                    f"created from {self.describe_ref()}."
+                )
+
+    def describe_ref(self) -> str:
+        for kind in ["tag", "branch"]:
+            if self.manifest[kind] is not None:
+                return f"{kind} {self.manifest[kind]}"
+        return f"commit {self.manifest['commit']}"
+
+    def resolve_ref(self, ref: Optional[str]) -> Optional[str]:
+        """Return the bundled commit, a bundle contains exactly one ref."""
+        return self.manifest["commit"]
+
+    def get_commit(self, path: str) -> Optional[str]:
+        return self.manifest["commit"]
+
+    def get_source_file_declaration(self, path: str, tag: str, branch: str):
+        try:
+            origin = get_provider(self.source_url)
+        except UserError:
+            # e.g. a local repository that is not available on this machine
+            return f'"{path}"'
+        return origin.get_source_file_declaration(path, tag, branch)
+
+
+PROVIDERS = [Bundle, Github, Gitlab, Local]
@@ -12,6 +12,7 @@ from snakedeploy.exceptions import UserError
 from snakedeploy.logger import logger
 
 
+@logger.timed()
 def get_repo():
     g = Github(
         os.environ["GITHUB_TOKEN"],
@@ -57,6 +58,7 @@ class PR:
     def add_file(self, filepath, content, is_updated, msg):
         self.files.append(File(str(filepath), content, is_updated, msg))
 
+    @logger.timed("PR.create")
     @retry(tries=2, delay=60)
     def create(self):
         if not self.files:
@@ -0,0 +1,315 @@
+from contextlib import contextmanager
+from itertools import chain
+import json
+import os
+from pathlib import Path
+import sqlite3
+import time
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import unquote, urlparse
+
+from snakedeploy.conda_version import VersionOrder, VersionSpec
+from snakedeploy.logger import logger
+from snakedeploy.utils import get_cache_dir
+
+# timeout in seconds for downloading repodata
+DOWNLOAD_TIMEOUT = 300
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    id INTEGER PRIMARY KEY,
+    url TEXT UNIQUE NOT NULL,
+    subdir TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS packages (
+    source INTEGER NOT NULL REFERENCES sources (id),
+    name TEXT NOT NULL,
+    version TEXT NOT NULL,
+    build TEXT NOT NULL,
+    build_number INTEGER NOT NULL,
+    fn TEXT NOT NULL,
+    depends TEXT NOT NULL,
+    md5 TEXT
+);
+CREATE INDEX IF NOT EXISTS packages_by_name ON packages (name, source);
+CREATE TABLE IF NOT EXISTS latest (
+    source INTEGER NOT NULL REFERENCES sources (id),
+    name TEXT NOT NULL,
+    version TEXT NOT NULL,
+    PRIMARY KEY (name, source)
+) WITHOUT ROWID;
+"""
+
+
+class RepodataStore:
+    """
+    A local index of the package metadata (repodata.json) of conda channel
+    subdirs, kept in an SQLite database keyed by package name and subdir
+    (by default in the snakedeploy cache directory).
+
+    Repodata is read from file:// channels (e.g. local mirrors) or
+    downloaded, and only imported again once it has changed, as determined
+    via the ETag or Last-Modified headers of remote channels and the
+    modification time of local ones. Each repodata file is checked at most
+    once per process. If remote repodata cannot be obtained, the previously
+    imported one is used, such that queries also work offline.
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = Path(path or get_cache_dir() / "repodata.sqlite")
+        self._db = None
+        # source ids of the already checked repodata URLs (None if unavailable)
+        self._sources = {}
+
+    def __getstate__(self):
+        # connections cannot be shared between processes
+        return dict(self.__dict__, _db=None)
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(self.path.parent, exist_ok=True)
+            # transactions are handled explicitly, see transaction()
+            self._db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode = WAL")
+            self._db.executescript(SCHEMA)
+        return self._db
+
+    @contextmanager
+    def transaction(self):
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+
+    def get_source(self, url: str) -> Optional[int]:
+        """
+        Return the id of the repodata at the given URL in the store, after
+        importing it if it has changed. Returns None if it has never been
+        obtained.
+        """
+        if url in self._sources:
+            return self._sources[url]
+        row = self.db.execute(
+            "SELECT id, etag, last_modified FROM sources WHERE url = ?", (url,)
+        ).fetchone()
+        source, etag, last_modified = row or (None, None, None)
+        fetched = self.fetch(url, etag, last_modified)
+        if fetched is None:
+            if source is not None:
+                logger.debug(f"Using previously imported repodata of {url}.")
+        else:
+            etag, last_modified, repodata = fetched
+            if repodata is None:
+                self.db.execute(
+                    "UPDATE sources SET updated = ? WHERE id = ?", (time.time(), source)
+                )
+            else:
+                source = self.store(url, etag, last_modified, repodata)
+        self._sources[url] = source
+        return source
+
+    @logger.timed("RepodataStore.fetch")
+    def fetch(
+        self, url: str, etag: Optional[str], last_modified: Optional[str]
+    ) -> Optional[tuple]:
+        """
+        Obtain the repodata at the given URL, unless it matches the given
+        ETag or Last-Modified values. Returns the new values along with the
+        parsed repodata (None if unchanged, empty if there is no such file,
+        e.g. for channels without noarch packages), or None if it cannot be
+        obtained.
+        """
+        if url.startswith("file://"):
+            path = unquote(urlparse(url).path)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                return "missing", None, (None if etag == "missing" else {})
+            # for local files, the ETag is derived from modification time and size
+            state = f"{stat.st_mtime_ns}-{stat.st_size}"
+            if state == etag:
+                return etag, None, None
+            try:
+                with open(path, "rb") as f:
+                    return state, None, json.load(f)
+            except (OSError, ValueError) as e:
+                logger.debug(f"Failed to read {url}: {e}")
+                return None
+
+        import requests
+
+        from snakedeploy.providers import get_session
+
+        headers = {}
+        if etag is not None:
+            headers["If-None-Match"] = etag
+        if last_modified is not None:
+            headers["If-Modified-Since"] = last_modified
+        try:
+            response = get_session().get(url, headers=headers, timeout=DOWNLOAD_TIMEOUT)
+            if response.status_code == 304:
+                return etag, last_modified, None
+            if response.status_code == 404:
+                return None, None, {}
+            response.raise_for_status()
+            return (
+                response.headers.get("ETag"),
+                response.headers.get("Last-Modified"),
+                response.json(),
+            )
+        except (requests.RequestException, ValueError) as e:
+            logger.debug(f"Failed to download {url}: {e}")
+            return None
+
+    @logger.timed("RepodataStore.store")
+    def store(
+        self,
+        url: str,
+        etag: Optional[str],
+        last_modified: Optional[str],
+        repodata: Dict,
+    ) -> int:
+        """Replace the stored repodata of the given URL. Returns its source id."""
+        subdir = url.rstrip("/").split("/")[-2]
+        packages = []
+        versions = {}
+        for fn, record in chain(
+            (repodata.get("packages") or {}).items(),
+            (repodata.get("packages.conda") or {}).items(),
+        ):
+            name, version = record["name"], record["version"]
+            packages.append(
+                (
+                    name,
+                    version,
+                    record.get("build", ""),
+                    record.get("build_number", 0),
+                    fn,
+                    json.dumps(record.get("depends") or []),
+                    record.get("md5"),
+                )
+            )
+            versions.setdefault(name, set()).add(version)
+
+        with self.transaction():
+            self.db.execute(
+                "INSERT INTO sources (url, subdir, etag, last_modified, updated) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT (url) DO UPDATE SET "
+                "etag = excluded.etag, last_modified = excluded.last_modified, "
+                "updated = excluded.updated",
+                (url, subdir, etag, last_modified, time.time()),
+            )
+            (source,) = self.db.execute(
+                "SELECT id FROM sources WHERE url = ?", (url,)
+            ).fetchone()
+            self.db.execute("DELETE FROM packages WHERE source = ?", (source,))
+            self.db.execute("DELETE FROM latest WHERE source = ?", (source,))
+            self.db.executemany(
+                "INSERT INTO packages VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                ((source, *package) for package in packages),
+            )
+            self.db.executemany(
+                "INSERT INTO latest VALUES (?, ?, ?)",
+                (
+                    (source, name, max(versions, key=_version_order))
+                    for name, versions in versions.items()
+                ),
+            )
+        return source
+
+    def get_sources(self, urls: Iterable[str]) -> Optional[List[int]]:
+        sources = [self.get_source(url) for url in urls]
+        return None if None in sources else sources
+
+    def latest_versions(self, url: str) -> Optional[Dict[str, str]]:
+        """
+        Return the latest version of each package in the repodata at the
+        given URL, or None if it cannot be obtained.
+        """
+        source = self.get_source(url)
+        if source is None:
+            return None
+        return dict(
+            self.db.execute(
+                "SELECT name, version FROM latest WHERE source = ?", (source,)
+            )
+        )
+
+    def latest_version(self, name: str, urls: Iterable[str]) -> Optional[str]:
+        """
+        Return the latest version of the given package in the repodata at
+        any of the given URLs. Returns None if there is no such package or
+        any of the repodata cannot be obtained.
+        """
+        sources = self.get_sources(urls)
+        if not sources:
+            return None
+        versions = [
+            version
+            for (version,) in self.db.execute(
+                "SELECT version FROM latest WHERE name = ? AND source IN "
+                f"({', '.join('?' * len(sources))})",
+                (name, *sources),
+            )
+        ]
+        return max(versions, key=_version_order, default=None)
+
+    def find(
+        self, name: str, urls: Iterable[str], spec: Optional[str] = None
+    ) -> Optional[List[Dict]]:
+        """
+        Return the records of all builds of the given package in the
+        repodata at any of the given URLs, optionally restricted to versions
+        matching the given conda version spec (e.g. ">=1.2,<2" or "1.2.*").
+        Returns None if any of the repodata cannot be obtained.
+        """
+        sources = self.get_sources(urls)
+        if sources is None:
+            return None
+        if not sources:
+            return []
+        version_spec = VersionSpec(spec) if spec else None
+        records = []
+        for url, subdir, *package in self.db.execute(
+            "SELECT url, subdir, name, version, build, build_number, fn, depends, md5 "
+            "FROM packages JOIN sources ON packages.source = sources.id "
+            f"WHERE name = ? AND source IN ({', '.join('?' * len(sources))})",
+            (name, *sources),
+        ):
+            name, version, build, build_number, fn, depends, md5 = package
+            if version_spec is not None:
+                try:
+                    if not version_spec.match(version):
+                        continue
+                except ValueError:
+                    # invalid versions match no spec
+                    continue
+            records.append(
+                dict(
+                    name=name,
+                    version=version,
+                    build=build,
+                    build_number=build_number,
+                    fn=fn,
+                    subdir=subdir,
+                    url=f"{url.rsplit('/', 1)[0]}/{fn}",
+                    depends=json.loads(depends),
+                    md5=md5,
+                )
+            )
+        return records
+
+
+def _version_order(version: str):
+    # invalid versions are considered older than all valid ones
+    try:
+        return (1, VersionOrder(version))
+    except ValueError:
+        return (0, version)
@@ -0,0 +1,314 @@
+from contextlib import contextmanager
+import json
+import os
+from pathlib import Path
+import posixpath
+import threading
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import unquote, urlparse
+
+import yaml
+
+from snakedeploy.exceptions import UserError
+from snakedeploy.utils import get_cache_dir
+
+# the libyaml based loader is much faster, but not available everywhere
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+SCHEMA_EXTENSIONS = ["yaml", "yml", "json"]
+
+TABLE_SEPARATORS = {".tsv": "\t", ".csv": ","}
+
+# rows of sample sheets that are validated at once
+DEFAULT_CHUNKSIZE = 10000
+
+# further violations are only counted
+MAX_REPORTED_ERRORS = 20
+
+
+SCHEMA_DIR = "workflow/schemas"
+
+
+def load_yaml(path: Path):
+    with open(path, "rb") as f:
+        return yaml.load(f, Loader=YamlLoader)
+
+
+class SchemaSource:
+    """
+    The schema files of a workflow at a given commit (None if unknown),
+    either read from a local copy of the repository at root, or obtained
+    via fetch, a function that takes a list of paths (relative to the
+    repository root) and returns their contents (None for missing files).
+    """
+
+    def __init__(
+        self,
+        commit: Optional[str],
+        root: Optional[str] = None,
+        fetch: Optional[Callable[[List[str]], Dict[str, Optional[bytes]]]] = None,
+    ):
+        self.commit = commit
+        self.root = root
+        self.fetch = fetch
+
+    @property
+    def key(self):
+        # without a commit, schemas of local copies are only distinguishable by path
+        return self.commit or self.root
+
+    def read(self, paths: List[str]) -> Dict[str, Optional[bytes]]:
+        if self.fetch is not None:
+            return self.fetch(paths)
+        contents = {}
+        for path in paths:
+            try:
+                with open(os.path.join(self.root, path), "rb") as f:
+                    contents[path] = f.read()
+            except FileNotFoundError:
+                contents[path] = None
+        return contents
+
+    def load(self, item: str):
+        """
+        Parse workflow/schemas/{item}.schema.{yaml|yml|json}. Returns None if
+        there is no such file.
+        """
+        paths = [f"{SCHEMA_DIR}/{item}.schema.{ext}" for ext in SCHEMA_EXTENSIONS]
+        contents = self.read(paths)
+        for path in paths:
+            if contents[path] is not None:
+                return yaml.load(contents[path], Loader=YamlLoader)
+        return None
+
+
+class SchemaCache:
+    """
+    Parsed workflow schemas and compiled validators, keyed by commit and item.
+
+    Parsed schemas are kept in memory and, if the commit is known, also on
+    disk as JSON, such that each schema is parsed from YAML only once per
+    commit. Validators are compiled once per process and reused.
+    """
+
+    def __init__(self, cache_dir: Optional[Path] = None):
+        self.path = Path(cache_dir or get_cache_dir()) / "schemas"
+        self._schemas = {}
+        self._validators = {}
+        self._lock = threading.Lock()
+
+    def disk_path(self, commit: str, item: str) -> Path:
+        return self.path / commit / f"{item}.json"
+
+    def get(self, source: SchemaSource, item: str) -> Optional[Dict]:
+        """
+        Return the parsed schema of the given item from the given source.
+        If the commit of the source is unknown, the schema is only cached in
+        memory. Returns None if the workflow does not provide such a schema.
+        """
+        commit = source.commit
+        key = (source.key, item)
+        with self._lock:
+            if key in self._schemas:
+                return self._schemas[key]
+
+        cached = False
+        if commit is not None:
+            try:
+                with open(self.disk_path(commit, item)) as f:
+                    schema = json.load(f)["schema"]
+                cached = True
+            except (OSError, ValueError, KeyError):
+                pass
+        if not cached:
+            schema = source.load(item)
+            if commit is not None:
+                self.store(commit, item, schema)
+
+        with self._lock:
+            return self._schemas.setdefault(key, schema)
+
+    def store(self, commit: str, item: str, schema: Optional[Dict]):
+        path = self.disk_path(commit, item)
+        try:
+            os.makedirs(path.parent, exist_ok=True)
+            tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+            with open(tmp_path, "w") as f:
+                # missing schemas are cached as well
+                json.dump({"schema": schema}, f, default=str)
+            os.replace(tmp_path, path)
+        except OSError:
+            # the cache is an optimization only
+            pass
+
+    def get_validator(self, source: SchemaSource, item: str):
+        """
+        Return a compiled validator for the schema of the given item (see
+        get), or None if the workflow does not provide such a schema.
+        References to other schema files are resolved relative to the
+        schema directory.
+        """
+        key = (source.key, item)
+        with self._lock:
+            if key in self._validators:
+                return self._validators[key]
+
+        schema = self.get(source, item)
+        validator = None
+        if schema is not None:
+            from jsonschema.exceptions import SchemaError
+            from jsonschema.validators import validator_for
+            from referencing import Registry
+            from referencing.jsonschema import DRAFT202012, specification_with
+
+            cls = validator_for(schema)
+            try:
+                cls.check_schema(schema)
+            except SchemaError as e:
+                raise UserError(f"Invalid schema for {item}: {e.message}")
+            # referenced schema files default to the dialect of this one
+            spec = specification_with(schema.get("$schema", ""), default=DRAFT202012)
+            registry = Registry(retrieve=lambda uri: _retrieve(source, uri, spec))
+            validator = cls(schema, registry=registry)
+
+        with self._lock:
+            return self._validators.setdefault(key, validator)
+
+    def validate(self, source: SchemaSource, item: str, data):
+        """
+        Validate data against the schema of the given item. Raises a
+        UserError listing all violations.
+        """
+        validator = self.require_validator(source, item)
+        with _reraise_unresolvable(item):
+            errors = sorted(
+                validator.iter_errors(data), key=lambda e: [str(p) for p in e.path]
+            )
+        if errors:
+            raise UserError(
+                f"Invalid {item}:\n" + "\n".join(format_error(e) for e in errors)
+            )
+
+    def validate_table(
+        self,
+        source: SchemaSource,
+        item: str,
+        path: Path,
+        chunksize: int = DEFAULT_CHUNKSIZE,
+    ):
+        """
+        Validate each row of the given sample sheet (TSV or CSV) against the
+        schema of the given item. The sheet is read in chunks of chunksize
+        rows, such that memory usage does not grow with its size. As in
+        Snakemake, empty cells are omitted from the validated records.
+        Cells are read as strings, only columns declared as integer, number
+        or boolean in the schema are converted accordingly.
+        Raises a UserError listing the first violations.
+        """
+        import pandas as pd
+
+        validator = self.require_validator(source, item)
+        converters = get_table_converters(self.get(source, item))
+        sep = TABLE_SEPARATORS.get(Path(path).suffix, "\t")
+        errors = []
+        n_errors = 0
+        row = 0
+        with _reraise_unresolvable(item):
+            try:
+                for chunk in pd.read_csv(path, sep=sep, chunksize=chunksize, dtype=str):
+                    for record in chunk.to_dict("records"):
+                        row += 1
+                        record = {
+                            k: converters[k](v) if k in converters else v
+                            for k, v in record.items()
+                            if pd.notna(v)
+                        }
+                        for e in validator.iter_errors(record):
+                            n_errors += 1
+                            if len(errors) < MAX_REPORTED_ERRORS:
+                                errors.append(f"row {row}: {format_error(e)}")
+            except (OSError, ValueError) as e:
+                raise UserError(f"Failed to read {path}: {e}")
+        if errors:
+            if n_errors > len(errors):
+                errors.append(f"... and {n_errors - len(errors)} more violations")
+            raise UserError(f"Invalid {item} in {path}:\n" + "\n".join(errors))
+
+    def require_validator(self, source: SchemaSource, item: str):
+        validator = self.get_validator(source, item)
+        if validator is None:
+            raise UserError(f"The workflow does not provide a schema for {item}.")
+        return validator
+
+
+def get_table_converters(schema: Dict) -> Dict[str, Callable[[str], Any]]:
+    """
+    Return converters for the cells of the sample sheet columns that are
+    declared as integer, number or boolean (and not as string) in the
+    properties of the given schema. Cells that cannot be converted are kept
+    as strings, such that the validator reports them.
+    """
+    converters = {}
+    for column, definition in (schema.get("properties") or {}).items():
+        types = definition.get("type") if isinstance(definition, dict) else None
+        types = {types} if isinstance(types, str) else set(types or ())
+        if "string" in types:
+            continue
+        if types & {"integer", "number"}:
+            converters[column] = _to_number
+        elif "boolean" in types:
+            converters[column] = _to_boolean
+    return converters
+
+
+def _to_number(value: str):
+    for convert in (int, float):
+        try:
+            return convert(value)
+        except ValueError:
+            pass
+    return value
+
+
+def _to_boolean(value: str):
+    return {"true": True, "false": False}.get(value.lower(), value)
+
+
+@contextmanager
+def _reraise_unresolvable(item: str):
+    """
+    Raise a UserError if a reference in the schema of the given item cannot
+    be resolved during validation. Since referencing wraps the errors raised
+    by _retrieve, the message of such an underlying UserError is used.
+    """
+    from referencing.exceptions import Unresolvable
+
+    try:
+        yield
+    except Unresolvable as e:
+        cause = e
+        while cause is not None and not isinstance(cause, UserError):
+            cause = cause.__cause__
+        raise UserError(f"Invalid schema for {item}: {cause or e}")
+
+
+def format_error(error) -> str:
+    return f"{'/'.join(map(str, error.path)) or '<root>'}: {error.message}"
+
+
+def _retrieve(source: SchemaSource, uri: str, spec):
+    from referencing import Resource
+
+    path = unquote(urlparse(uri).path)
+    if os.path.isabs(path):
+        try:
+            contents = load_yaml(path)
+        except OSError as e:
+            raise UserError(f"Failed to load referenced schema {uri}: {e}")
+    else:
+        path = posixpath.normpath(posixpath.join(SCHEMA_DIR, path))
+        data = source.read([path])[path]
+        if data is None:
+            raise UserError(f"Referenced schema {uri} does not exist.")
+        contents = yaml.load(data, Loader=YamlLoader)
+    return Resource.from_contents(contents, default_specification=spec)
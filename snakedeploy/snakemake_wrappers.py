@@ -6,9 +6,9 @@ from urllib.parse import urlparse
 import subprocess as sp
 from snakedeploy.exceptions import UserError
 from snakedeploy.logger import logger
-from snakedeploy.prs import PR, get_repo
 
 
+@logger.timed()
 def get_latest_git_tag(path: Path, repo: Path) -> str | None:
     """Get the latest git tag of any file in the given directory or below.
     Thereby ignore later git tags outside of the given directory.
@@ -53,6 +53,7 @@ def get_sparse_checkout_patterns() -> Iterable[str]:
 
 
 class WrapperRepo:
+    @logger.timed("WrapperRepo.clone")
     def __init__(self):
         self.tmpdir = tempfile.TemporaryDirectory()
         logger.info("Cloning snakemake-wrappers repository...")
@@ -107,6 +108,8 @@ def update_snakemake_wrappers(
     repo = None
     pr = None
     if create_prs:
+        from snakedeploy.prs import PR, get_repo
+
         repo = get_repo()
         if pr_add_label and not entity_regex:
             raise UserError("Cannot add label to PR without --entity-regex specified.")
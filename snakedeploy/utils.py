@@ -4,11 +4,25 @@ __author__ = "Vanessa Sochat"
 __copyright__ = "Copyright 2020-2021, Vanessa Sochat"
 __license__ = "MPL 2.0"
 
+from collections import Counter
+import errno
+import hashlib
+import os
+from pathlib import Path
+import re
+import shutil
 import subprocess
 import sys
 
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
 import yaml
 
+from snakedeploy.exceptions import UserError
+
 
 class YamlDumper(yaml.Dumper):
     def increase_indent(self, flow=False, *args, **kwargs):
@@ -65,3 +79,158 @@ def run_command(
 
     output = {"lines": lines, "return_code": process.returncode}
     return output
+
+
+def get_file_hash(path, algorithm="sha256") -> str:
+    """Return the hex digest of the given file's content."""
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_cache_dir() -> Path:
+    """Return the snakedeploy cache directory, following the XDG base directory spec."""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return Path(cache_home) / "snakedeploy"
+
+
+def parse_size(size: str) -> int:
+    """Parse a human readable size like 500M or 5G into bytes."""
+    units = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+    match = re.match(r"^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$", size, re.IGNORECASE)
+    if match is None:
+        raise UserError(f"Invalid size {size} (expected e.g. 500M or 5G).")
+    return int(float(match.group(1)) * units[match.group(2).upper()])
+
+
+LINK_MODES = ["copy", "hardlink", "reflink", "auto"]
+
+# ioctl request for cloning a file on Linux (supported by e.g. btrfs and xfs)
+FICLONE = 0x40049409
+
+
+def reflink(src, dst):
+    """Create a copy-on-write clone of src at dst, replacing dst if it exists."""
+    if fcntl is None or not sys.platform.startswith("linux"):
+        raise OSError(errno.EOPNOTSUPP, "Reflinks are not supported on this platform")
+    # never write into dst, it might be hardlinked to other files
+    if os.path.lexists(dst):
+        os.unlink(dst)
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    shutil.copystat(src, dst)
+    return dst
+
+
+def hardlink(src, dst):
+    """Hardlink src to dst, replacing dst if it exists."""
+    if os.path.lexists(dst):
+        os.unlink(dst)
+    os.link(src, dst)
+    return dst
+
+
+def copy_file(src, dst):
+    """Copy src to dst (see shutil.copy2), replacing dst if it exists."""
+    # never write into dst, it might be hardlinked to other files
+    if os.path.lexists(dst):
+        os.unlink(dst)
+    return shutil.copy2(src, dst)
+
+
+def get_copy_function(link_mode: str = "copy", allow_hardlink: bool = True):
+    """
+    Return a copy function (e.g. for shutil.copytree) that links files
+    according to the given link mode. Modes:
+
+    copy: plain copy
+    hardlink: hardlink, fall back to copy (e.g. across filesystems)
+    reflink: copy-on-write clone, fall back to copy
+    auto: reflink, then hardlink, then copy
+
+    With allow_hardlink=False, files are never hardlinked (e.g. because the
+    source files are shared with other destinations or belong to the user).
+    Existing files at the destination are always replaced, not written into.
+    """
+    if link_mode not in LINK_MODES:
+        raise UserError(
+            f"Invalid link mode {link_mode} (expected one of {', '.join(LINK_MODES)})."
+        )
+    strategies = {
+        "copy": [],
+        "hardlink": [hardlink],
+        "reflink": [reflink],
+        "auto": [reflink, hardlink],
+    }[link_mode]
+    if not allow_hardlink:
+        strategies = [strategy for strategy in strategies if strategy is not hardlink]
+    if not strategies:
+        return copy_file
+    # strategies that failed with an error indicating missing support
+    unsupported = set()
+
+    def copy(src, dst):
+        for strategy in strategies:
+            if strategy in unsupported:
+                continue
+            try:
+                return strategy(src, dst)
+            except OSError as e:
+                if e.errno in (
+                    errno.EXDEV,
+                    errno.EOPNOTSUPP,
+                    errno.ENOTTY,
+                    errno.EINVAL,
+                    errno.EPERM,
+                    errno.EMLINK,
+                ):
+                    unsupported.add(strategy)
+                else:
+                    raise
+        return copy_file(src, dst)
+
+    return copy
+
+
+def sync_file(src, dst, copy_function=copy_file) -> str:
+    """
+    Copy src to dst unless dst already has the same content. Files with equal
+    size and modification time are considered equal without reading them.
+    Returns "added", "changed" or "unchanged".
+    """
+    try:
+        dst_stat = os.stat(dst)
+    except FileNotFoundError:
+        copy_function(src, dst)
+        return "added"
+    src_stat = os.stat(src)
+    if src_stat.st_size == dst_stat.st_size and (
+        src_stat.st_mtime_ns == dst_stat.st_mtime_ns
+        or get_file_hash(src) == get_file_hash(dst)
+    ):
+        return "unchanged"
+    copy_function(src, dst)
+    return "changed"
+
+
+def sync_tree(src, dst, copy_function=copy_file) -> Counter:
+    """
+    Recursively copy src to dst, only writing files that differ (see
+    sync_file). Files that only exist in dst are kept. Returns the number of
+    added, changed and unchanged files.
+    """
+    counts = Counter()
+    for root, _, files in os.walk(src):
+        target_dir = os.path.join(dst, os.path.relpath(root, src))
+        os.makedirs(target_dir, exist_ok=True)
+        for f in files:
+            counts[
+                sync_file(
+                    os.path.join(root, f), os.path.join(target_dir, f), copy_function
+                )
+            ] += 1
+    return counts
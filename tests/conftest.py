@@ -0,0 +1,177 @@
+import bz2
+from functools import partial
+import hashlib
+import http.server
+import io
+import json
+import os
+import shutil
+import subprocess as sp
+import tarfile
+import threading
+
+import pytest
+
+# name, version and dependencies of the packages in the conda_channel fixture
+CHANNEL_PACKAGES = [
+    ("alpha", "1.0", ["beta >=1.0"]),
+    ("alpha", "2.0", ["beta >=1.1"]),
+    ("beta", "1.0", []),
+    ("beta", "1.1", []),
+    ("gamma", "0.9", []),
+    ("gamma", "1.10", ["alpha"]),
+]
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    def __init__(self, server, *args, **kwargs):
+        self.stand_in = server
+        super().__init__(*args, **kwargs)
+
+    def do_GET(self):
+        self.stand_in.requested.append(self.path)
+        content = self.stand_in.responses.get(self.path)
+        if content is None:
+            self.send_error(404)
+            return
+        etag = self.stand_in.etags.get(self.path)
+        if etag is not None and self.headers.get("If-None-Match") == etag:
+            self.stand_in.not_modified += 1
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        if etag is not None:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInServer:
+    """
+    An HTTP server on localhost standing in for e.g. GitHub or a conda
+    channel. It serves the given responses (by path, including the query),
+    answering with 304 if the client already has the ETag given for a path,
+    and records the requested paths.
+    """
+
+    def __init__(self):
+        self.responses = {}
+        self.etags = {}
+        self.requested = []
+        self.not_modified = 0
+        self._server = http.server.ThreadingHTTPServer(
+            ("127.0.0.1", 0), partial(StandInHandler, self)
+        )
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self._server.server_port}"
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+@pytest.fixture
+def http_server():
+    server = StandInServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture(scope="session")
+def conda_exe():
+    conda = os.environ.get("CONDA_EXE") or shutil.which("conda")
+    if conda is None:
+        pytest.skip("conda is not available")
+    return conda
+
+
+@pytest.fixture(scope="session")
+def conda_platform(conda_exe):
+    info = sp.run(
+        [conda_exe, "info", "--json"], check=True, stdout=sp.PIPE, text=True
+    ).stdout
+    return json.loads(info)["platform"]
+
+
+def make_conda_package(name, version, depends, subdir):
+    """Return the index record and the content of a package with a single file."""
+    index = dict(
+        name=name,
+        version=version,
+        build="h0_0",
+        build_number=0,
+        depends=depends,
+        subdir=subdir,
+        license="MIT",
+        timestamp=1700000000000,
+    )
+    path = f"share/{name}.txt"
+    paths = dict(
+        paths=[
+            dict(
+                _path=path,
+                path_type="hardlink",
+                sha256=hashlib.sha256(version.encode()).hexdigest(),
+                size_in_bytes=len(version),
+            )
+        ],
+        paths_version=1,
+    )
+    files = {
+        "info/index.json": json.dumps(index).encode(),
+        "info/files": f"{path}\n".encode(),
+        "info/paths.json": json.dumps(paths).encode(),
+        path: version.encode(),
+    }
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as package:
+        for member, data in files.items():
+            info = tarfile.TarInfo(member)
+            info.size = len(data)
+            package.addfile(info, io.BytesIO(data))
+    return index, bz2.compress(buffer.getvalue())
+
+
+@pytest.fixture
+def conda_channel(tmp_path, conda_exe, conda_platform, monkeypatch):
+    """
+    A local channel of CHANNEL_PACKAGES, configured as a channel of conda,
+    along with an empty package cache. Returns its file:// URL.
+    """
+    channel = tmp_path / "channel"
+    records = {}
+    for name, version, depends in CHANNEL_PACKAGES:
+        index, content = make_conda_package(name, version, depends, conda_platform)
+        fn = f"{name}-{version}-{index['build']}.tar.bz2"
+        (channel / conda_platform).mkdir(parents=True, exist_ok=True)
+        (channel / conda_platform / fn).write_bytes(content)
+        records[fn] = dict(
+            index,
+            md5=hashlib.md5(content).hexdigest(),
+            sha256=hashlib.sha256(content).hexdigest(),
+            size=len(content),
+        )
+    for subdir, packages in [(conda_platform, records), ("noarch", {})]:
+        (channel / subdir).mkdir(exist_ok=True)
+        with open(channel / subdir / "repodata.json", "w") as f:
+            json.dump(
+                {
+                    "info": {"subdir": subdir},
+                    "packages": packages,
+                    "packages.conda": {},
+                },
+                f,
+            )
+    url = f"file://{channel}"
+    condarc = tmp_path / "condarc"
+    condarc.write_text(f"channels:\n  - {url}\nnotify_outdated_conda: false\n")
+    monkeypatch.setenv("CONDARC", str(condarc))
+    monkeypatch.setenv("CONDA_PKGS_DIRS", str(tmp_path / "pkgs"))
+    return url
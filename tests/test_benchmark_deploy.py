@@ -0,0 +1,139 @@
+"""
+Benchmarks of deploy-workflow against synthetic local git repositories.
+
+Run them (and compare against a saved baseline) with e.g.
+
+    pytest tests/test_benchmark_deploy.py --benchmark-autosave
+    pytest tests/test_benchmark_deploy.py --benchmark-compare
+
+The size of the synthetic repositories is controlled by the constants below.
+"""
+
+from contextlib import ExitStack
+import itertools
+import subprocess as sp
+
+import pytest
+
+from snakedeploy.deploy import WorkflowDeployer, deploy
+
+pytest.importorskip("pytest_benchmark")
+
+N_COMMITS = 500
+N_CONFIG_DIRS = 20
+N_CONFIG_FILES_PER_DIR = 50
+N_PROFILES = 50
+ROUNDS = 5
+
+SNAKEFILE = "configfile: 'config/config.yaml'\n\nrule all:\n    input: []\n"
+CONFIG_SCHEMA = "type: object\nrequired: [samples]\n"
+
+
+def fast_import_blob(path, content):
+    data = content.encode()
+    return b"M 644 inline %s\ndata %d\n%s\n" % (path.encode(), len(data), data)
+
+
+def make_history():
+    """Yield a git fast-import stream of a workflow repository."""
+    files = {
+        "workflow/Snakefile": SNAKEFILE,
+        "workflow/schemas/config.schema.yaml": CONFIG_SCHEMA,
+        "workflow/rules/common.smk": "# not deployed\n",
+        "LICENSE": "MIT\n",
+        "config/samples.tsv": "sample\n"
+        + "".join(f"s{i}\n" for i in range(N_CONFIG_FILES_PER_DIR)),
+    }
+    for i in range(N_CONFIG_DIRS):
+        for j in range(N_CONFIG_FILES_PER_DIR):
+            files[f"config/dir{i}/file{j}.yaml"] = f"key{j}: {'x' * 200}\n"
+    for i in range(N_PROFILES):
+        files[f"profiles/profile{i}/config.yaml"] = f"cores: {i}\njobs: 100\n"
+
+    for n in range(N_COMMITS):
+        changes = dict(files) if n == 0 else {}
+        changes["config/config.yaml"] = f"samples: config/samples.tsv\nversion: {n}\n"
+        yield b"commit refs/heads/main\n"
+        yield b"committer Bench <bench@example.com> %d +0000\n" % (1700000000 + n)
+        message = f"commit {n}".encode()
+        yield b"data %d\n%s\n" % (len(message), message)
+        for path, content in changes.items():
+            yield fast_import_blob(path, content)
+        yield b"\n"
+    yield b"reset refs/tags/v1.0.0\nfrom refs/heads/main\n\n"
+
+
+@pytest.fixture(scope="module")
+def source_repo(tmp_path_factory):
+    # file:// URLs are handled by the provider named in them, i.e. Github here
+    repo = tmp_path_factory.mktemp("bench") / "github.com" / "bench" / "workflow"
+    repo.parent.mkdir(parents=True)
+    sp.run(["git", "init", "--quiet", "-b", "main", str(repo)], check=True)
+    sp.run(
+        ["git", "fast-import", "--quiet"],
+        input=b"".join(make_history()),
+        cwd=repo,
+        check=True,
+    )
+    sp.run(["git", "checkout", "--quiet", "-f", "main"], cwd=repo, check=True)
+    return repo
+
+
+@pytest.fixture(params=["local", "file"])
+def source(request, source_repo):
+    if request.param == "local":
+        return str(source_repo)
+    return f"file://{source_repo}"
+
+
+@pytest.fixture
+def dests(tmp_path):
+    counter = itertools.count()
+    return lambda: tmp_path / f"dest{next(counter)}"
+
+
+def test_deploy(benchmark, source, dests):
+    def setup():
+        return (source,), {
+            "name": "bench",
+            "tag": "v1.0.0",
+            "branch": None,
+            "dest_path": dests(),
+        }
+
+    benchmark.pedantic(deploy, setup=setup, rounds=ROUNDS)
+
+
+def test_deploy_step_clone(benchmark, source, dests):
+    with ExitStack() as stack:
+
+        def setup():
+            deployer = WorkflowDeployer(source, dests(), tag="v1.0.0")
+            return (stack.enter_context(deployer),), {}
+
+        benchmark.pedantic(
+            lambda deployer: deployer.repo_clone, setup=setup, rounds=ROUNDS
+        )
+
+
+def test_deploy_step_copy(benchmark, source, dests):
+    def copy(deployer):
+        deployer.deploy_config()
+        deployer.deploy_profile()
+        deployer.deploy_license()
+
+    with WorkflowDeployer(source, dests(), tag="v1.0.0") as deployer:
+        deployer.repo_clone
+        benchmark.pedantic(
+            copy, setup=lambda: ((deployer.for_dest(dests()),), {}), rounds=ROUNDS
+        )
+
+
+def test_deploy_step_render(benchmark, source, dests):
+    with WorkflowDeployer(source, dests(), tag="v1.0.0") as deployer:
+        repo_clone = deployer.repo_clone
+        benchmark.pedantic(
+            deployer.deploy_snakefile,
+            setup=lambda: ((repo_clone, "bench"), {}),
+            rounds=ROUNDS,
+        )
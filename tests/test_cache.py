@@ -0,0 +1,144 @@
+import os
+import subprocess as sp
+import threading
+import time
+
+import pytest
+
+from snakedeploy.cache import CloneCache, SolveCache, file_lock, get_dir_size
+
+RECORDS = [
+    {
+        "name": "alpha",
+        "version": "1.0",
+        "url": "file:///channel/linux-64/alpha-1.0-h0_0.tar.bz2",
+        "md5": "d2ac0cca1060b807d5b6e18ef97c6dcd",
+    }
+]
+
+
+def test_solve_cache(tmp_path):
+    cache = SolveCache(tmp_path)
+    assert cache.get("a" * 64) is None
+    cache.put("a" * 64, RECORDS)
+    assert cache.get("a" * 64) == RECORDS
+    assert SolveCache(tmp_path).get("a" * 64) == RECORDS
+    assert cache.get("b" * 64) is None
+
+
+def test_solve_cache_ttl(tmp_path):
+    cache = SolveCache(tmp_path, ttl=60)
+    cache.put("a" * 64, RECORDS)
+    stored = time.time() - 120
+    os.utime(cache.entry_path("a" * 64), (stored, stored))
+    assert cache.get("a" * 64) is None
+    cache.evict()
+    assert not cache.entry_path("a" * 64).exists()
+
+
+def test_solve_cache_evict(tmp_path):
+    cache = SolveCache(tmp_path)
+    for i, key in enumerate("abc"):
+        cache.put(key * 64, RECORDS)
+        stored = time.time() - 10 + i
+        os.utime(cache.entry_path(key * 64), (stored, stored))
+    cache.max_size = 2 * cache.entry_path("a" * 64).stat().st_size
+    cache.evict()
+    # the oldest entry is evicted first
+    assert cache.get("a" * 64) is None
+    assert cache.get("b" * 64) == RECORDS
+    assert cache.get("c" * 64) == RECORDS
+
+
+def make_repo(path, content):
+    path.mkdir(parents=True)
+    (path / "config").mkdir()
+    (path / "config" / "config.yaml").write_text(content)
+    (path / "README.md").write_text("not deployed\n")
+    sp.run(["git", "init", "--quiet", "-b", "main"], cwd=path, check=True)
+    sp.run(["git", "add", "--all"], cwd=path, check=True)
+    sp.run(
+        [
+            "git",
+            "-c",
+            "user.name=Test",
+            "-c",
+            "user.email=test@example.com",
+            "commit",
+            "--quiet",
+            "-m",
+            "initial",
+        ],
+        cwd=path,
+        check=True,
+    )
+    return f"file://{path}"
+
+
+@pytest.fixture
+def repo(tmp_path):
+    return make_repo(tmp_path / "repo", "samples: s.tsv\n")
+
+
+def test_clone_cache_materialize(repo, tmp_path):
+    cache = CloneCache(tmp_path / "cache")
+    commit = cache.materialize(repo, None, str(tmp_path / "a"))
+    assert (tmp_path / "a" / "config" / "config.yaml").read_text() == "samples: s.tsv\n"
+    assert not (tmp_path / "a" / "README.md").exists()
+    assert cache.has_commit(cache.mirror_path(repo), commit)
+
+
+def test_clone_cache_reuses_mirrored_commit(repo, tmp_path, monkeypatch):
+    cache = CloneCache(tmp_path / "cache")
+    commit = cache.materialize(repo, "main", str(tmp_path / "a"))
+
+    def fail(source_url):
+        raise AssertionError(f"{source_url} fetched again")
+
+    monkeypatch.setattr(cache, "update", fail)
+    assert cache.materialize(repo, commit, str(tmp_path / "b")) == commit
+    assert (tmp_path / "b" / "config" / "config.yaml").exists()
+    # refs other than commits might have moved, hence they are fetched
+    with pytest.raises(AssertionError, match="fetched again"):
+        cache.materialize(repo, "main", str(tmp_path / "c"))
+
+
+def test_clone_cache_lock(repo, tmp_path):
+    cache = CloneCache(tmp_path / "cache")
+    lock = cache.lock_path(cache.mirror_path(repo))
+    with file_lock(lock):
+        thread = threading.Thread(
+            target=cache.materialize, args=(repo, None, str(tmp_path / "a"))
+        )
+        thread.start()
+        thread.join(timeout=0.5)
+        # waits for the lock of the mirror
+        assert thread.is_alive()
+        assert not cache.mirror_path(repo).exists()
+    thread.join()
+    assert (tmp_path / "a" / "config" / "config.yaml").exists()
+
+
+def test_clone_cache_evict(tmp_path):
+    cache = CloneCache(tmp_path / "cache")
+    repos = [
+        make_repo(tmp_path / name, f"name: {name}\n") for name in ("old", "mid", "new")
+    ]
+    for i, repo in enumerate(repos):
+        cache.materialize(repo, None, str(tmp_path / f"dest{i}"))
+        used = time.time() - 10 + i
+        os.utime(cache.lock_path(cache.mirror_path(repo)), (used, used))
+    old, mid, new = (cache.mirror_path(repo) for repo in repos)
+
+    # the least recently used mirror is evicted first
+    cache.max_size = get_dir_size(mid) + get_dir_size(new)
+    cache.evict()
+    assert not old.exists()
+    assert mid.exists() and new.exists()
+
+    # mirrors in use are never evicted
+    cache.max_size = 0
+    with file_lock(cache.lock_path(mid)):
+        cache.evict()
+    assert mid.exists()
+    assert not new.exists()
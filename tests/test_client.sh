@@ -40,6 +40,17 @@ echo
 echo "#### Testing snakedeploy directory exists but enforcing"
 runTest 0 $output snakedeploy deploy-workflow "${repo}" "${dest}" --tag v1.0.0 --force
 
+echo
+echo "#### Testing snakedeploy deployment from a manifest"
+manifest=$tmpdir/manifest.tsv
+printf "repo\tdest\ttag\tbranch\tname\n" > $manifest
+for cohort in cohort1 cohort2
+do
+    printf "${repo}\t$tmpdir/manifest-testing/$cohort\tv1.0.0\t\tdna-seq\n" >> $manifest
+done
+runTest 0 $output snakedeploy deploy-workflow --manifest $manifest
+runTest 0 $output test -f $tmpdir/manifest-testing/cohort2/workflow/Snakefile
+
 echo
 echo "#### Testing snakedeploy GitLab deployment"
 dest=$tmpdir/gitlab-testing
@@ -71,6 +82,8 @@ runTest 0 $output snakedeploy update-conda-envs --conda-frontend conda $tmpdir/t
 echo
 echo "#### Testing snakedeploy pin-conda-envs"
 runTest 0 $output snakedeploy pin-conda-envs --conda-frontend conda $tmpdir/test-env.yaml
+runTest 0 $output snakedeploy pin-conda-envs --conda-frontend conda --create-envs $tmpdir/test-env.yaml
+runTest 0 $output snakedeploy pin-conda-envs --conda-frontend conda --batch-solve --no-solve-cache $tmpdir/test-env.yaml
 
 echo
 echo "#### Testing snakedeploy update-snakemake-wrappers"
@@ -0,0 +1,274 @@
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+import yaml
+
+from snakedeploy import conda
+from snakedeploy.client import get_parser, main
+from snakedeploy.conda import CondaEnvProcessor, get_pinned_version
+from snakedeploy.exceptions import UserError
+from snakedeploy.logger import logger
+
+
+def test_get_pinned_version():
+    assert get_pinned_version("numpy =1.21") == "1.21"
+    assert get_pinned_version("numpy=1.21") == "1.21"
+    assert get_pinned_version("numpy ==1.21.0") == "1.21.0"
+    assert get_pinned_version("  numpy = 1.21 ") == "1.21"
+    assert get_pinned_version("numpy") is None
+    assert get_pinned_version("numpy >=1.21") is None
+    assert get_pinned_version("numpy =1.21.*") is None
+    assert get_pinned_version("numpy =1.21 py39_0") is None
+
+
+class StepProcessor(CondaEnvProcessor):
+    """
+    Processes envs in a few logged steps instead of solving them (without
+    conda). Envs with a name starting with "bad" fail.
+    """
+
+    def __init__(self, **kwargs):
+        self.solve_cache = None
+        self.precheck = False
+        self._session = None
+
+    def process_env(self, conda_env_path, **kwargs):
+        name = Path(conda_env_path).stem
+        with logger.span("process_env", env=name):
+            for step in range(3):
+                logger.info(f"{name} step {step}")
+                time.sleep(0.05)
+        if name.startswith("bad"):
+            raise UserError(f"{name} failed")
+        return []
+
+
+def write_envs(tmp_path, names):
+    for name in names:
+        (tmp_path / f"{name}.yaml").write_text("dependencies: []\n")
+    return [str(tmp_path / "*.yaml")]
+
+
+def test_parallel_logs_replayed_per_env(tmp_path, monkeypatch):
+    msgs = []
+    monkeypatch.setattr(logger, "log_handler", [msgs.append])
+    monkeypatch.setattr(logger, "spans", [])
+    names = [f"env{i}" for i in range(6)]
+    StepProcessor().process(write_envs(tmp_path, names), jobs=3)
+
+    envs = [msg["msg"].split()[0] for msg in msgs if msg["level"] == "info"]
+    assert sorted(envs) == sorted(names * 3)
+    # the messages of each env are contiguous
+    assert all(len(set(envs[i : i + 3])) == 1 for i in range(0, len(envs), 3))
+    # the spans of the workers have been merged
+    assert sorted(span["args"]["env"] for span in logger.spans) == sorted(names)
+    assert all(span["pid"] != os.getpid() for span in logger.spans)
+
+
+def test_parallel_error_cancels_remaining(tmp_path, monkeypatch):
+    envs = write_envs(tmp_path, [f"bad{i}" for i in range(12)])
+    monkeypatch.setattr(conda, "CondaEnvProcessor", StepProcessor)
+    monkeypatch.setattr(sys, "argv", ["snakedeploy", "pin-conda-envs", "--jobs", "2"])
+    sys.argv.extend(envs)
+    with pytest.raises(SystemExit) as e:
+        main()
+    assert e.value.code == 1
+
+    with pytest.raises(UserError) as e:
+        StepProcessor().process(envs, jobs=2)
+    # only the envs that were already running or queued have been processed
+    assert 1 <= len(str(e.value).splitlines()) < 12
+
+
+@pytest.mark.parametrize("subcommand", ["pin-conda-envs", "deploy-workflow"])
+@pytest.mark.parametrize("jobs", ["0", "x"])
+def test_invalid_jobs(subcommand, jobs, monkeypatch, capsys):
+    monkeypatch.setattr(sys, "argv", ["snakedeploy", subcommand, "--jobs", jobs])
+    with pytest.raises(SystemExit) as e:
+        main()
+    assert e.value.code == 2
+    assert f"must be a positive integer, got {jobs}" in capsys.readouterr().err
+
+
+def write_env(path, dependencies, channel):
+    # only the given channel, such that nothing is obtained from the network
+    path.write_text(
+        yaml.dump(dict(channels=[channel, "nodefaults"], dependencies=dependencies))
+    )
+    return str(path)
+
+
+def test_batch_solve_session_per_worker(conda_exe, conda_channel, tmp_path):
+    envs = [
+        write_env(tmp_path / f"env{i}.yaml", [f"{name} ={version}"], conda_channel)
+        for i, (name, version) in enumerate(
+            [("alpha", "2.0"), ("beta", "1.0"), ("gamma", "0.9"), ("gamma", "1.10")]
+        )
+    ]
+    with CondaEnvProcessor(
+        conda_frontend=conda_exe, solve_cache=False, batch_solve=True
+    ) as processor:
+        # record the process ids of the started solver sessions
+        startups = tmp_path / "startups"
+        wrapper = tmp_path / "python"
+        wrapper.write_text(
+            f'#!/bin/sh\necho $$ >> {startups}\nexec {processor.info["sys.executable"]} "$@"\n'
+        )
+        wrapper.chmod(0o755)
+        processor.info["sys.executable"] = str(wrapper)
+        processor.process(envs, update_envs=False, pin_envs=True, jobs=2)
+
+    assert all(processor.get_pin_file_path(env).exists() for env in envs)
+    pids = startups.read_text().split()
+    assert 1 <= len(pids) <= 2
+    for pid in pids:
+        # the sessions have been closed (and waited for) by the workers
+        with pytest.raises(ProcessLookupError):
+            os.kill(int(pid), 0)
+
+
+def test_solve_matches_create_envs(conda_exe, conda_channel, tmp_path):
+    pin_files = []
+    for create_envs in (False, True):
+        env = write_env(
+            tmp_path / f"env-{create_envs}.yaml", ["gamma =1.10"], conda_channel
+        )
+        with CondaEnvProcessor(
+            conda_frontend=conda_exe, solve_cache=False, create_envs=create_envs
+        ) as processor:
+            processor.process([env], update_envs=False, pin_envs=True)
+            pin_files.append(processor.get_pin_file_path(env).read_text())
+
+    solved, created = pin_files
+    assert solved == created
+    urls = [line.split("#")[0] for line in solved.splitlines()[-3:]]
+    assert [url.rsplit("/", 1)[-1] for url in urls] == [
+        "beta-1.1-h0_0.tar.bz2",
+        "alpha-2.0-h0_0.tar.bz2",
+        "gamma-1.10-h0_0.tar.bz2",
+    ]
+
+
+def test_solve_records_from_fetch_and_package_cache(
+    conda_exe, conda_channel, tmp_path, monkeypatch
+):
+    url = f"{conda_channel}/linux-64"
+    linked = [
+        dict(name=name, version=version, dist_name=f"{name}-{version}-h0_0")
+        for name, version in [("alpha", "2.0"), ("beta", "1.1"), ("gamma", "0.9")]
+    ]
+    fetched = dict(linked[0], url=f"{url}/alpha-2.0-h0_0.tar.bz2", md5="1" * 32, fn="x")
+    cached = dict(linked[1], url=f"{url}/beta-1.1-h0_0.tar.bz2", md5="2" * 32)
+    with_url = dict(linked[2], url=f"{url}/gamma-0.9-h0_0.tar.bz2", md5="3" * 32)
+    record_path = tmp_path / "pkgs" / "beta-1.1-h0_0" / "info" / "repodata_record.json"
+    record_path.parent.mkdir(parents=True)
+    record_path.write_text(json.dumps(cached))
+
+    processor = CondaEnvProcessor(conda_frontend=conda_exe, solve_cache=False)
+    processor.info["pkgs_dirs"] = [str(tmp_path / "missing"), str(tmp_path / "pkgs")]
+    actions = dict(FETCH=[fetched], LINK=[linked[0], linked[1], with_url])
+    monkeypatch.setattr(
+        processor,
+        "exec_conda",
+        lambda cmd: SimpleNamespace(stdout=json.dumps(dict(actions=actions))),
+    )
+    env = dict(channels=[conda_channel, "nodefaults"], dependencies=["alpha"])
+    assert processor.solve(env) == [fetched, cached, with_url]
+    assert processor.format_explicit(processor.solve(env)).splitlines()[-4:] == [
+        "@EXPLICIT",
+        f"{url}/alpha-2.0-h0_0.tar.bz2#{'1' * 32}",
+        f"{url}/beta-1.1-h0_0.tar.bz2#{'2' * 32}",
+        f"{url}/gamma-0.9-h0_0.tar.bz2#{'3' * 32}",
+    ]
+
+    # neither fetched nor in the package cache
+    actions["LINK"].append(dict(name="delta", version="1.0", dist_name="delta-1.0-0"))
+    with pytest.raises(
+        UserError, match="Cannot determine URL and checksum of package delta-1.0-0"
+    ):
+        processor.solve(env)
+
+
+def test_pinning_reuses_posterior_solve(conda_exe, conda_channel, tmp_path):
+    env = write_env(tmp_path / "env.yaml", ["gamma =0.9"], conda_channel)
+    with CondaEnvProcessor(conda_frontend=conda_exe, solve_cache=False) as processor:
+        calls = dict(solve=0, exec_conda=0)
+        for method in calls:
+
+            def counted(*args, method=method, func=getattr(processor, method)):
+                calls[method] += 1
+                return func(*args)
+
+            setattr(processor, method, counted)
+        pin_file = processor.get_pin_file_path(env)
+
+        # updated: pinned to the records of the posterior solve
+        processor.process([env])
+        assert calls == dict(solve=2, exec_conda=2)
+        assert yaml.safe_load(open(env))["dependencies"] == ["gamma =1.10"]
+        assert (
+            pin_file.read_text()
+            .splitlines()[-1]
+            .startswith(
+                f"{conda_channel}/{processor.info['platform']}/gamma-1.10-h0_0.tar.bz2#"
+            )
+        )
+        pinning = pin_file.read_text()
+
+        # not updated, but the pin file is missing
+        pin_file.unlink()
+        processor.process([env])
+        assert calls == dict(solve=4, exec_conda=4)
+        assert pin_file.read_text() == pinning
+
+
+def test_solve_key(conda_exe, conda_channel, conda_platform, tmp_path):
+    env = dict(channels=[conda_channel, "nodefaults"], dependencies=["alpha", "beta"])
+    reordered = dict(env, dependencies=["beta", "alpha"])
+    repodata = tmp_path / "channel" / conda_platform / "repodata.json"
+    processor = CondaEnvProcessor(conda_frontend=conda_exe, solve_cache=False)
+    key = processor.get_solve_key(env)
+    assert key is not None
+    assert processor.get_solve_key(reordered) == key
+
+    def current_key():
+        # the states of the repodata are determined once per run
+        processor._repodata_states.clear()
+        return processor.get_solve_key(env)
+
+    assert current_key() == key
+    stat = repodata.stat()
+    os.utime(repodata, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    mtime_key = current_key()
+    assert mtime_key != key
+    with open(repodata, "a") as f:
+        f.write("\n")
+    os.utime(repodata, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert current_key() not in (key, mtime_key)
+
+
+def test_get_scratch_dir(conda_exe, tmp_path):
+    # a file cannot contain the scratch dir (unlike a read-only dir when root)
+    not_a_dir = tmp_path / "file"
+    not_a_dir.write_text("")
+    pkgs_dir = tmp_path / "pkgs"
+    processor = CondaEnvProcessor(conda_frontend=conda_exe, solve_cache=False)
+
+    processor.info["pkgs_dirs"] = [str(not_a_dir), str(pkgs_dir)]
+    assert processor.get_scratch_dir() == str(pkgs_dir / ".snakedeploy")
+    assert (pkgs_dir / ".snakedeploy").is_dir()
+
+    processor.info["pkgs_dirs"] = [str(not_a_dir)]
+    assert processor.get_scratch_dir() == "."
+
+    processor.scratch_dir = str(tmp_path / "scratch")
+    assert processor.get_scratch_dir() == str(tmp_path / "scratch")
+    assert (tmp_path / "scratch").is_dir()
+
+    args = get_parser().parse_args(["pin-conda-envs", "--scratch-dir", "x", "e.yaml"])
+    assert args.scratch_dir == "x"
@@ -0,0 +1,325 @@
+import io
+import json
+import os
+import subprocess as sp
+import sys
+import tarfile
+
+import pytest
+
+from snakedeploy import deploy as deploy_module, providers
+from snakedeploy.client import get_parser, main
+from snakedeploy.deploy import (
+    LOCKFILE,
+    DeployTarget,
+    bundle_workflow,
+    deploy,
+    deploy_many,
+)
+from snakedeploy.exceptions import UserError
+from snakedeploy.logger import logger
+from snakedeploy.utils import LINK_MODES, get_copy_function
+
+FILES = {
+    "workflow/Snakefile": "configfile: 'config/config.yaml'\n",
+    "workflow/schemas/config.schema.yaml": "type: object\n",
+    "config/config.yaml": "samples: config/samples.tsv\n",
+    "config/samples.tsv": "sample\ns1\n",
+    "profiles/default/config.yaml": "cores: 1\n",
+    "LICENSE": "MIT\n",
+}
+
+
+def git(repo, *args):
+    return sp.run(
+        ["git", *args], cwd=repo, check=True, stdout=sp.PIPE, text=True
+    ).stdout.strip()
+
+
+def commit(repo, files, message):
+    for path, content in files.items():
+        (repo / path).parent.mkdir(parents=True, exist_ok=True)
+        (repo / path).write_text(content)
+    git(repo, "add", "--all")
+    git(
+        repo,
+        "-c",
+        "user.name=Test",
+        "-c",
+        "user.email=test@example.com",
+        "commit",
+        "--quiet",
+        "-m",
+        message,
+    )
+    return git(repo, "rev-parse", "HEAD")
+
+
+@pytest.fixture
+def source_repo(tmp_path):
+    # file:// URLs are handled by the provider named in them, i.e. Github here
+    repo = tmp_path / "github.com" / "test" / "workflow"
+    repo.mkdir(parents=True)
+    git(repo, "init", "--quiet", "-b", "main")
+    commit(repo, FILES, "initial")
+    git(repo, "tag", "v1.0.0")
+    return repo
+
+
+def test_deploy_many_never_hardlinks(source_repo, tmp_path):
+    targets = [
+        DeployTarget(f"file://{source_repo}", tmp_path / dest, "v1.0.0", None, None)
+        for dest in ("d1", "d2")
+    ]
+    deploy_many(targets, link_mode="hardlink")
+
+    config1 = tmp_path / "d1" / "config" / "config.yaml"
+    config2 = tmp_path / "d2" / "config" / "config.yaml"
+    assert not os.path.samefile(config1, config2)
+    config1.write_text("changed\n")
+    assert config2.read_text() == FILES["config/config.yaml"]
+
+
+@pytest.mark.parametrize("link_mode", LINK_MODES)
+def test_copy_function_replaces_dst(tmp_path, link_mode):
+    src = tmp_path / "src"
+    src.write_text("new\n")
+    dst = tmp_path / "dst"
+    dst.write_text("old\n")
+    sibling = tmp_path / "sibling"
+    os.link(dst, sibling)
+
+    get_copy_function(link_mode, allow_hardlink=False)(src, dst)
+    assert dst.read_text() == "new\n"
+    assert sibling.read_text() == "old\n"
+    assert not os.path.samefile(src, dst)
+
+
+def test_deploy_many_continues_after_failed_group(source_repo, tmp_path):
+    targets = [
+        DeployTarget(f"file://{source_repo}", tmp_path / "d1", "v9", None, None),
+        DeployTarget(str(tmp_path / "missing"), tmp_path / "d2", "v1.0.0", None, None),
+        DeployTarget(f"file://{source_repo}", tmp_path / "d3", "v1.0.0", None, None),
+    ]
+    with pytest.raises(UserError, match="2 of 3 deployments failed"):
+        deploy_many(targets)
+    assert not (tmp_path / "d1").exists()
+    assert not (tmp_path / "d2").exists()
+    assert (tmp_path / "d3" / "workflow" / "Snakefile").exists()
+
+
+@pytest.fixture
+def bundle(source_repo, tmp_path):
+    return bundle_workflow(
+        f"file://{source_repo}", tmp_path / "workflow.sdbundle", tag="v1.0.0"
+    )
+
+
+def test_bundle_rejects_other_ref(bundle, tmp_path):
+    with pytest.raises(UserError, match="does not contain tag v2.0.0"):
+        deploy(str(bundle), None, "v2.0.0", None, tmp_path / "dest")
+    with pytest.raises(UserError, match="does not contain branch main"):
+        deploy(str(bundle), None, None, "main", tmp_path / "dest")
+    deploy(str(bundle), None, "v1.0.0", None, tmp_path / "dest")
+
+
+def test_bundle_update_skips_up_to_date(bundle, tmp_path, caplog):
+    dest = tmp_path / "dest"
+    deploy(str(bundle), None, None, None, dest)
+    deploy(str(bundle), None, None, None, dest, update=True)
+    assert f"{dest} is up to date" in caplog.text
+
+
+def test_update_detects_modified_snakefile(source_repo, tmp_path, caplog):
+    source = f"file://{source_repo}"
+    dest = tmp_path / "dest"
+    deploy(source, None, "v1.0.0", None, dest)
+    snakefile = (dest / "workflow" / "Snakefile").read_text()
+
+    # modified config files are kept if the deployment is up to date ...
+    (dest / "config" / "config.yaml").write_text("modified\n")
+    deploy(source, None, "v1.0.0", None, dest, update=True)
+    assert f"{dest} is up to date" in caplog.text
+    assert (dest / "config" / "config.yaml").read_text() == "modified\n"
+    # ... unless forced
+    deploy(source, None, "v1.0.0", None, dest, update=True, force=True)
+    assert (dest / "config" / "config.yaml").read_text() == FILES["config/config.yaml"]
+
+    caplog.clear()
+    (dest / "workflow" / "Snakefile").write_text("modified\n")
+    deploy(source, None, "v1.0.0", None, dest, update=True)
+    assert "is up to date" not in caplog.text
+    assert (dest / "workflow" / "Snakefile").read_text() == snakefile
+
+
+def test_lockfile_hashes_shared(source_repo, tmp_path, monkeypatch):
+    hashed = []
+    get_file_hash = deploy_module.get_file_hash
+    monkeypatch.setattr(
+        deploy_module,
+        "get_file_hash",
+        lambda path: hashed.append(str(path)) or get_file_hash(path),
+    )
+    targets = [
+        DeployTarget(f"file://{source_repo}", tmp_path / dest, "v1.0.0", None, None)
+        for dest in ("d1", "d2")
+    ]
+    deploy_many(targets)
+
+    # the four files from the clone once, the rendered Snakefile per destination
+    assert len(hashed) == 4 + 2
+    lock1 = json.loads((tmp_path / "d1" / LOCKFILE).read_text())
+    lock2 = json.loads((tmp_path / "d2" / LOCKFILE).read_text())
+    assert lock1 == lock2
+    assert set(lock1["files"]) == {
+        "config/config.yaml",
+        "config/samples.tsv",
+        "profiles/default/config.yaml",
+        "LICENSE",
+        "workflow/Snakefile",
+    }
+
+
+def test_bundle_deploy_matches_live_deploy(source_repo, bundle, tmp_path):
+    deploy(f"file://{source_repo}", "wf", "v1.0.0", None, tmp_path / "live")
+    deploy(str(bundle), "wf", None, None, tmp_path / "offline")
+    for path in FILES:
+        if not path.startswith("workflow/"):
+            assert (tmp_path / "offline" / path).read_text() == FILES[path]
+    assert (tmp_path / "offline" / "workflow" / "Snakefile").read_text() == (
+        tmp_path / "live" / "workflow" / "Snakefile"
+    ).read_text()
+
+
+def test_corrupted_bundle(bundle, tmp_path):
+    corrupted = tmp_path / "corrupted.sdbundle"
+    with tarfile.open(bundle, "r:gz") as src, tarfile.open(corrupted, "w:gz") as dst:
+        for member in src:
+            content = src.extractfile(member).read()
+            if member.name == "config/config.yaml":
+                content = b"samples: other.tsv\n"
+                member.size = len(content)
+            dst.addfile(member, io.BytesIO(content))
+    with pytest.raises(UserError, match="is corrupted: config/config.yaml differs"):
+        deploy(str(corrupted), None, None, None, tmp_path / "dest")
+
+    truncated = tmp_path / "truncated.sdbundle"
+    truncated.write_bytes(bundle.read_bytes()[:20])
+    with pytest.raises(UserError, match="Invalid bundle"):
+        deploy(str(truncated), None, None, None, tmp_path / "dest")
+
+    no_manifest = tmp_path / "no-manifest.sdbundle"
+    with tarfile.open(no_manifest, "w:gz") as dst:
+        manifest = tarfile.TarInfo(providers.BUNDLE_MANIFEST)
+        manifest.type = tarfile.DIRTYPE
+        dst.addfile(manifest)
+    with pytest.raises(UserError, match="Invalid bundle"):
+        deploy(str(no_manifest), None, None, None, tmp_path / "dest")
+
+
+def test_update_counts_and_keeps_unchanged(source_repo, tmp_path, caplog):
+    source = f"file://{source_repo}"
+    dest = tmp_path / "dest"
+    deploy(source, None, "v1.0.0", None, dest)
+    unchanged = ["config/samples.tsv", "profiles/default/config.yaml", "LICENSE"]
+    for path in unchanged:
+        os.utime(dest / path, ns=(1_000_000_000, 1_000_000_000))
+
+    commit(
+        source_repo,
+        {"config/config.yaml": "samples: other.tsv\n", "config/new.yaml": "a: 1\n"},
+        "update config",
+    )
+    git(source_repo, "tag", "v1.1.0")
+    deploy(source, None, "v1.1.0", None, dest, update=True)
+
+    assert "1 added, 2 changed, 3 unchanged files" in caplog.text
+    assert (dest / "config" / "config.yaml").read_text() == "samples: other.tsv\n"
+    assert (dest / "config" / "new.yaml").exists()
+    assert "v1.1.0" in (dest / "workflow" / "Snakefile").read_text()
+    for path in unchanged:
+        assert (dest / path).stat().st_mtime_ns == 1_000_000_000
+
+
+def test_lockfile_round_trip(source_repo, tmp_path, caplog, monkeypatch):
+    monkeypatch.setattr(providers, "_resolved_refs", {})
+    source = f"file://{source_repo}"
+    dest = tmp_path / "dest"
+    deploy(source, None, None, "main", dest)
+    lock = json.loads((dest / LOCKFILE).read_text())
+    assert lock["commit"] == git(source_repo, "rev-parse", "HEAD")
+    assert lock["branch"] == "main"
+
+    # the commit is unchanged
+    deploy(source, None, None, "main", dest, update=True)
+    assert f"{dest} is up to date" in caplog.text
+    assert json.loads((dest / LOCKFILE).read_text()) == lock
+
+    # the branch has moved
+    caplog.clear()
+    moved = commit(source_repo, {"config/config.yaml": "samples: b.tsv\n"}, "move")
+    # resolved refs are reused within a process
+    providers._resolved_refs.clear()
+    deploy(source, None, None, "main", dest, update=True)
+    assert "is up to date" not in caplog.text
+    assert (dest / "config" / "config.yaml").read_text() == "samples: b.tsv\n"
+    assert json.loads((dest / LOCKFILE).read_text())["commit"] == moved
+
+
+@pytest.mark.parametrize("before_subcommand", [True, False])
+def test_profile_json(source_repo, tmp_path, monkeypatch, before_subcommand):
+    monkeypatch.setattr(logger, "spans", None)
+    trace = tmp_path / "trace.json"
+    profile_args = ["--profile-json", str(trace)]
+    args = ["deploy-workflow", f"file://{source_repo}", str(tmp_path / "dest")]
+    args += ["--tag", "v1.0.0"]
+    if before_subcommand:
+        args = profile_args + args
+    else:
+        args += profile_args
+    monkeypatch.setattr(sys, "argv", ["snakedeploy", *args])
+    main()
+    events = json.loads(trace.read_text())["traceEvents"]
+    assert "deploy-workflow" in [event["name"] for event in events]
+
+
+def test_deploy_abbreviated_commit(source_repo, tmp_path):
+    first = git(source_repo, "rev-parse", "HEAD")
+    commit(source_repo, {"config/config.yaml": "samples: b.tsv\n"}, "second")
+    source = f"file://{source_repo}"
+    dest = tmp_path / "dest"
+    deploy(source, None, first[:7], None, dest)
+    assert json.loads((dest / LOCKFILE).read_text())["commit"] == first
+    assert (dest / "config" / "config.yaml").read_text() == FILES["config/config.yaml"]
+
+    with pytest.raises(UserError, match="Ref 0000000 does not exist"):
+        deploy(source, None, "0000000", None, tmp_path / "other")
+
+
+def test_validate_arg_before_positionals():
+    args = get_parser().parse_args(
+        ["deploy-workflow", "--validate", "config/config.yaml"]
+        + ["--validate", "config/samples.tsv", "repo", "dest", "--tag", "v1"]
+    )
+    assert args.validate == ["config/config.yaml", "config/samples.tsv"]
+    assert (args.repo, args.dest) == ("repo", "dest")
+
+
+def test_deploy_dirty_local_repo(tmp_path):
+    repo = tmp_path / "local"
+    repo.mkdir()
+    git(repo, "init", "--quiet", "-b", "main")
+    commit(repo, FILES, "initial")
+    # local repositories are read in place, including uncommitted changes
+    (repo / "config" / "config.yaml").write_text("samples: dirty.tsv\n")
+    (repo / "config" / "untracked.yaml").write_text("a: 1\n")
+    dest = tmp_path / "dest"
+    deploy(str(repo), None, None, "main", dest, link_mode="hardlink")
+
+    assert (dest / "config" / "config.yaml").read_text() == "samples: dirty.tsv\n"
+    assert (dest / "config" / "untracked.yaml").exists()
+    # the files belong to the user, they are never hardlinked
+    assert not os.path.samefile(
+        repo / "config" / "config.yaml", dest / "config" / "config.yaml"
+    )
+    assert not (dest / ".git").exists()
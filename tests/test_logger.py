@@ -0,0 +1,28 @@
+import json
+
+from snakedeploy.logger import Logger
+
+
+def test_trace(tmp_path):
+    logger = Logger()
+
+    @logger.timed()
+    def step():
+        with logger.span("inner", item="config"):
+            pass
+
+    step()
+    assert logger.spans is None
+
+    logger.enable_profiling()
+    step()
+    trace = tmp_path / "trace.json"
+    logger.write_trace(trace)
+
+    events = json.loads(trace.read_text())["traceEvents"]
+    assert [event["name"] for event in events] == ["test_trace.<locals>.step", "inner"]
+    outer, inner = events
+    assert all(event["ph"] == "X" for event in events)
+    assert inner["args"] == {"item": "config"}
+    assert outer["ts"] <= inner["ts"]
+    assert inner["ts"] + inner["dur"] <= outer["ts"] + outer["dur"]
@@ -0,0 +1,153 @@
+import io
+import tarfile
+
+import pytest
+
+from snakedeploy.exceptions import UserError
+from snakedeploy import providers
+from snakedeploy.providers import Github, Gitlab
+
+
+ARCHIVE_CONTENT = {
+    "config/config.yaml": "samples: config/samples.tsv\n",
+    "profiles/default/config.yaml": "cores: 1\n",
+    "workflow/Snakefile": "rule all:\n",
+    "workflow/schemas/config.schema.yaml": "type: object\n",
+    "workflow/rules/common.smk": "# not needed for deployment\n",
+    "results/huge.txt": "not needed for deployment\n",
+    "LICENSE.md": "MIT\n",
+}
+
+
+HEAD_COMMIT = "1" * 40
+TAG_OBJECT = "2" * 40
+TAG_COMMIT = "3" * 40
+
+
+def pkt_line(line):
+    data = line.encode()
+    return f"{len(data) + 4:04x}".encode() + data
+
+
+def make_ref_advertisement():
+    return b"".join(
+        [
+            pkt_line("# service=git-upload-pack\n"),
+            b"0000",
+            pkt_line(f"{HEAD_COMMIT} HEAD\0multi_ack symref=HEAD:refs/heads/main\n"),
+            pkt_line(f"{HEAD_COMMIT} refs/heads/main\n"),
+            pkt_line(f"{TAG_OBJECT} refs/tags/v1.0.0\n"),
+            pkt_line(f"{TAG_COMMIT} refs/tags/v1.0.0^{{}}\n"),
+            b"0000",
+        ]
+    )
+
+
+def make_archive(prefix):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+        for path, content in ARCHIVE_CONTENT.items():
+            data = content.encode()
+            info = tarfile.TarInfo(f"{prefix}/{path}")
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def github(http_server):
+    http_server.responses.update(
+        {
+            "/dna-seq/tar.gz/v1.0.0": make_archive("dna-seq-1.0.0"),
+            "/owner/dna-seq.git/info/refs?service=git-upload-pack": (
+                make_ref_advertisement()
+            ),
+            f"/owner/dna-seq/raw/{TAG_COMMIT}/config/config.yaml": b"samples: s.tsv\n",
+            f"/owner/dna-seq/raw/{TAG_COMMIT}/LICENSE.md": b"MIT\n",
+        }
+    )
+    return http_server
+
+
+def test_archive_urls():
+    github = Github("https://github.com/snakemake-workflows/dna-seq")
+    assert (
+        github.get_archive_url("v1.0.0")
+        == "https://codeload.github.com/snakemake-workflows/dna-seq/tar.gz/v1.0.0"
+    )
+    gitlab = Gitlab("https://gitlab.com/group/dna-seq")
+    assert (
+        gitlab.get_archive_url("feature/x")
+        == "https://gitlab.com/group/dna-seq/-/archive/feature%2Fx/dna-seq.tar.gz"
+    )
+
+
+def test_download_archive(github, tmp_path, monkeypatch):
+    provider = Github("https://github.com/snakemake-workflows/dna-seq")
+    monkeypatch.setattr(
+        provider, "get_archive_url", lambda ref: f"{github.url}/dna-seq/tar.gz/{ref}"
+    )
+
+    provider.download_archive(str(tmp_path), "v1.0.0")
+
+    assert github.requested == ["/dna-seq/tar.gz/v1.0.0"]
+    extracted = {
+        str(path.relative_to(tmp_path))
+        for path in tmp_path.rglob("*")
+        if path.is_file()
+    }
+    assert extracted == {
+        "config/config.yaml",
+        "profiles/default/config.yaml",
+        "workflow/Snakefile",
+        "workflow/schemas/config.schema.yaml",
+        "LICENSE.md",
+    }
+    assert (tmp_path / "config" / "config.yaml").read_text() == ARCHIVE_CONTENT[
+        "config/config.yaml"
+    ]
+
+
+def test_download_archive_unknown_ref(github, tmp_path, monkeypatch):
+    provider = Github("https://github.com/snakemake-workflows/dna-seq")
+    monkeypatch.setattr(
+        provider, "get_archive_url", lambda ref: f"{github.url}/dna-seq/tar.gz/{ref}"
+    )
+
+    with pytest.raises(UserError, match="Failed to download archive of ref v9"):
+        provider.download_archive(str(tmp_path), "v9")
+
+
+def test_resolve_ref_http(github, monkeypatch):
+    provider = Github("https://github.com/owner/dna-seq")
+    provider.source_url = f"{github.url}/owner/dna-seq"
+    # resolve via the smart HTTP protocol, as without git
+    monkeypatch.setattr(providers.shutil, "which", lambda cmd: None)
+    monkeypatch.setattr(providers, "_resolved_refs", {})
+
+    assert provider.resolve_ref("v1.0.0") == TAG_COMMIT
+    assert provider.resolve_ref("main") == HEAD_COMMIT
+    assert provider.resolve_ref(None) == HEAD_COMMIT
+    assert provider.resolve_ref(TAG_OBJECT) == TAG_OBJECT
+    # resolved refs are reused
+    assert provider.resolve_ref("v1.0.0") == TAG_COMMIT
+    assert len(github.requested) == 3
+    with pytest.raises(UserError, match="Ref v9 does not exist"):
+        provider.resolve_ref("v9")
+
+
+def test_fetch_raw_files(github):
+    provider = Github("https://github.com/owner/dna-seq")
+    provider.source_url = f"{github.url}/owner/dna-seq"
+    assert provider.supports_raw_files()
+
+    paths = ["config/config.yaml", "LICENSE.md", "workflow/Snakefile"]
+    assert provider.fetch_raw_files(paths, TAG_COMMIT) == {
+        "config/config.yaml": b"samples: s.tsv\n",
+        "LICENSE.md": b"MIT\n",
+        "workflow/Snakefile": None,
+    }
+    assert sorted(github.requested) == sorted(
+        f"/owner/dna-seq/raw/{TAG_COMMIT}/{path}" for path in paths
+    )
+    assert providers.get_session() is providers.get_session()
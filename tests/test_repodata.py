@@ -0,0 +1,101 @@
+import json
+
+import pytest
+import requests
+
+from snakedeploy import providers
+from snakedeploy.repodata import RepodataStore
+
+PACKAGES = {
+    "linux-64": [("alpha", "1.9"), ("alpha", "1.10"), ("beta", "2.0")],
+    "noarch": [("alpha", "1.10.post1"), ("gamma", "0.1")],
+}
+
+
+def make_repodata(packages):
+    records = {
+        f"{name}-{version}-0.tar.bz2": dict(
+            name=name, version=version, build="0", build_number=0, depends=[]
+        )
+        for name, version in packages
+    }
+    return {"packages": records, "packages.conda": {}}
+
+
+@pytest.fixture
+def channel(tmp_path):
+    for subdir, packages in PACKAGES.items():
+        (tmp_path / "channel" / subdir).mkdir(parents=True)
+        with open(tmp_path / "channel" / subdir / "repodata.json", "w") as f:
+            json.dump(make_repodata(packages), f)
+    return f"file://{tmp_path / 'channel'}"
+
+
+@pytest.fixture
+def store(tmp_path):
+    return RepodataStore(tmp_path / "repodata.sqlite")
+
+
+def test_latest_versions(channel, store):
+    assert store.latest_versions(f"{channel}/linux-64/repodata.json") == {
+        "alpha": "1.10",
+        "beta": "2.0",
+    }
+    # subdirs without repodata are empty
+    assert store.latest_versions(f"{channel}/osx-64/repodata.json") == {}
+
+
+def test_latest_version(channel, store):
+    urls = [f"{channel}/{subdir}/repodata.json" for subdir in ("linux-64", "noarch")]
+    assert store.latest_version("alpha", urls) == "1.10.post1"
+    assert store.latest_version("gamma", urls) == "0.1"
+    assert store.latest_version("delta", urls) is None
+
+
+def test_find(channel, store):
+    urls = [f"{channel}/{subdir}/repodata.json" for subdir in ("linux-64", "noarch")]
+    found = store.find("alpha", urls, spec=">=1.10")
+    assert sorted((record["subdir"], record["version"]) for record in found) == [
+        ("linux-64", "1.10"),
+        ("noarch", "1.10.post1"),
+    ]
+    assert {record["url"] for record in found} == {
+        f"{channel}/linux-64/alpha-1.10-0.tar.bz2",
+        f"{channel}/noarch/alpha-1.10.post1-0.tar.bz2",
+    }
+    assert len(store.find("alpha", urls)) == 3
+    assert store.find("alpha", urls, spec="2.*") == []
+
+
+def test_local_update(channel, store, tmp_path):
+    url = f"{channel}/linux-64/repodata.json"
+    assert store.latest_versions(url)["beta"] == "2.0"
+    with open(tmp_path / "channel" / "linux-64" / "repodata.json", "w") as f:
+        json.dump(make_repodata([("beta", "2.1")]), f)
+    # checked once per process only
+    assert store.latest_versions(url)["beta"] == "2.0"
+    assert RepodataStore(store.path).latest_versions(url) == {"beta": "2.1"}
+
+
+def test_remote_update(store, http_server, monkeypatch):
+    # do not retry once the server is gone
+    monkeypatch.setattr(providers, "get_session", requests.Session)
+    path = "/linux-64/repodata.json"
+    http_server.responses[path] = json.dumps(
+        make_repodata(PACKAGES["linux-64"])
+    ).encode()
+    http_server.etags[path] = '"1"'
+    url = f"{http_server.url}{path}"
+    assert store.latest_version("alpha", [url]) == "1.10"
+    assert RepodataStore(store.path).latest_version("alpha", [url]) == "1.10"
+    assert http_server.not_modified == 1
+
+    http_server.responses[path] = json.dumps(
+        make_repodata([("alpha", "1.11")])
+    ).encode()
+    http_server.etags[path] = '"2"'
+    assert RepodataStore(store.path).latest_version("alpha", [url]) == "1.11"
+
+    # the imported repodata is used if the channel is not available
+    http_server.close()
+    assert RepodataStore(store.path).latest_version("alpha", [url]) == "1.11"
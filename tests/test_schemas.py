@@ -0,0 +1,153 @@
+import pytest
+
+from snakedeploy.exceptions import UserError
+from snakedeploy.schemas import SchemaCache, SchemaSource
+
+COMMIT = "a" * 40
+
+CONFIG_SCHEMA = """\
+$schema: "http://json-schema.org/draft-07/schema#"
+type: object
+properties:
+  samples:
+    type: string
+  threads:
+    $ref: "common.schema.yaml#/definitions/threads"
+required:
+  - samples
+"""
+
+COMMON_SCHEMA = """\
+definitions:
+  threads:
+    type: integer
+    minimum: 1
+"""
+
+
+@pytest.fixture
+def workflow(tmp_path):
+    schema_dir = tmp_path / "wf" / "workflow" / "schemas"
+    schema_dir.mkdir(parents=True)
+    (schema_dir / "config.schema.yaml").write_text(CONFIG_SCHEMA)
+    (schema_dir / "common.schema.yaml").write_text(COMMON_SCHEMA)
+    return SchemaSource(COMMIT, root=str(tmp_path / "wf"))
+
+
+def test_schema_parsed_once(workflow, tmp_path, monkeypatch):
+    cache = SchemaCache(tmp_path / "cache")
+    schema = cache.get(workflow, "config")
+    assert schema["required"] == ["samples"]
+    assert cache.get(workflow, "samples") is None
+
+    def fail(paths):
+        raise AssertionError(f"{paths} read again")
+
+    monkeypatch.setattr(workflow, "read", fail)
+    # from memory
+    assert cache.get(workflow, "config") is schema
+    # from disk, e.g. in a later run
+    other = SchemaCache(tmp_path / "cache")
+    assert other.get(workflow, "config") == schema
+    assert other.get(workflow, "samples") is None
+
+
+def test_fetched_schema(workflow, tmp_path):
+    fetched = []
+
+    def fetch(paths):
+        fetched.extend(paths)
+        return workflow.read(paths)
+
+    cache = SchemaCache(tmp_path / "cache")
+    source = SchemaSource(COMMIT, fetch=fetch)
+    cache.validate(source, "config", {"samples": "s.tsv", "threads": 2})
+    assert fetched == [
+        "workflow/schemas/config.schema.yaml",
+        "workflow/schemas/config.schema.yml",
+        "workflow/schemas/config.schema.json",
+        "workflow/schemas/common.schema.yaml",
+    ]
+
+
+def test_validate(workflow, tmp_path):
+    cache = SchemaCache(tmp_path / "cache")
+    cache.validate(workflow, "config", {"samples": "s.tsv", "threads": 2})
+    validator = cache.get_validator(workflow, "config")
+    assert cache.get_validator(workflow, "config") is validator
+
+    with pytest.raises(UserError) as e:
+        cache.validate(workflow, "config", {"threads": 0})
+    assert "'samples' is a required property" in str(e.value)
+    assert "threads: 0 is less than the minimum of 1" in str(e.value)
+
+    with pytest.raises(UserError, match="does not provide a schema for samples"):
+        cache.validate(workflow, "samples", {})
+
+
+def test_validate_table(workflow, tmp_path):
+    (tmp_path / "wf" / "workflow" / "schemas" / "samples.schema.yaml").write_text(
+        "type: object\n"
+        "properties:\n"
+        "  sample: {type: string}\n"
+        "  reads: {type: integer}\n"
+        "required: [sample, reads]\n"
+    )
+    sheet = tmp_path / "samples.tsv"
+    sheet.write_text(
+        "sample\treads\tnote\n"
+        + "".join(f"s{i}\t{'' if i == 5 else i}\t\n" for i in range(25))
+    )
+    cache = SchemaCache(tmp_path / "cache")
+
+    with pytest.raises(UserError) as e:
+        cache.validate_table(workflow, "samples", sheet, chunksize=10)
+    # empty cells are omitted, rows are counted across chunks
+    assert str(e.value).splitlines()[1:] == [
+        "row 6: <root>: 'reads' is a required property"
+    ]
+
+    sheet.write_text("sample\treads\n" + "".join(f"s{i}\t{i}\n" for i in range(25)))
+    cache.validate_table(workflow, "samples", sheet, chunksize=10)
+
+
+def test_validate_table_types(workflow, tmp_path):
+    (tmp_path / "wf" / "workflow" / "schemas" / "samples.schema.yaml").write_text(
+        "type: object\n"
+        "properties:\n"
+        "  sample: {type: string}\n"
+        "  reads: {type: integer}\n"
+        "  ratio: {type: number}\n"
+        "  paired: {type: boolean}\n"
+    )
+    sheet = tmp_path / "samples.tsv"
+    # numeric looking sample names are kept as strings
+    sheet.write_text(
+        "sample\treads\tratio\tpaired\n001\t10\t0.5\ttrue\n2\t3\t1\tFalse\n"
+    )
+    cache = SchemaCache(tmp_path / "cache")
+    cache.validate_table(workflow, "samples", sheet)
+
+    sheet.write_text("sample\treads\tratio\tpaired\ns1\tmany\t0.5\tyes\n")
+    with pytest.raises(UserError) as e:
+        cache.validate_table(workflow, "samples", sheet)
+    assert set(str(e.value).splitlines()[1:]) == {
+        "row 1: paired: 'yes' is not of type 'boolean'",
+        "row 1: reads: 'many' is not of type 'integer'",
+    }
+
+
+def test_unresolvable_reference(workflow, tmp_path):
+    schema_dir = tmp_path / "wf" / "workflow" / "schemas"
+    (schema_dir / "common.schema.yaml").unlink()
+    (schema_dir / "samples.schema.yaml").write_text(
+        "type: object\nproperties:\n  reads: {$ref: 'missing.schema.yaml'}\n"
+    )
+    sheet = tmp_path / "samples.tsv"
+    sheet.write_text("reads\n1\n")
+    cache = SchemaCache(tmp_path / "cache")
+
+    with pytest.raises(UserError, match="Referenced schema .* does not exist"):
+        cache.validate(workflow, "config", {"samples": "s.tsv", "threads": 2})
+    with pytest.raises(UserError, match="Referenced schema .* does not exist"):
+        cache.validate_table(workflow, "samples", sheet)
@@ -0,0 +1,62 @@
+import subprocess as sp
+import sys
+
+# Cumulative import time budget of snakedeploy.client in microseconds, with
+# plenty of headroom for slow machines. Without lazy imports, importing it
+# takes several times as long.
+IMPORT_BUDGET_US = 250_000
+
+# heavy dependencies that must only be imported when dispatching subcommands
+LAZY_MODULES = {
+    "github",
+    "jinja2",
+    "jsonschema",
+    "numpy",
+    "packaging",
+    "pandas",
+    "requests",
+    "urllib3",
+    "snakedeploy.conda",
+    "snakedeploy.deploy",
+    "snakedeploy.collect_files",
+    "snakedeploy.snakemake_wrappers",
+}
+
+
+def get_import_times(code, *args):
+    """Run the given code and return the cumulative import times by module."""
+    result = sp.run(
+        [sys.executable, "-X", "importtime", "-c", code, *args],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.strip()
+
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, module = line.split("|")
+        cumulative[module.strip()] = int(cumulative_us)
+    return cumulative
+
+
+def test_version_import_budget():
+    cumulative = get_import_times(
+        "from snakedeploy.client import main; main()", "--version"
+    )
+    assert not LAZY_MODULES & set(cumulative)
+    assert cumulative["snakedeploy.client"] < IMPORT_BUDGET_US
+
+
+def test_conda_subcommands_without_requests():
+    cumulative = get_import_times(
+        "from snakedeploy.client import main; main()", "update-conda-envs", "--help"
+    )
+    assert not LAZY_MODULES & set(cumulative)
+
+    # as imported when dispatching update-conda-envs or pin-conda-envs
+    cumulative = get_import_times("import snakedeploy.conda; print('ok')")
+    assert "snakedeploy.conda" in cumulative
+    assert not {"github", "requests", "snakedeploy.providers"} & set(cumulative)